@@ -0,0 +1,247 @@
+import base64
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Заголовок записи в сегменте: сигнатура, длина данных, crc32 данных
+FRAME = struct.Struct('<4sII')
+FRAME_MAGIC = b'ASR1'
+SEGMENT_SUFFIX = '.seg'
+
+
+class ArchiveCorruptedError(Exception):
+    """Запись в сегменте архива повреждена или не совпадает с индексом"""
+
+
+# Время и ошибки каждого публичного метода попадают в метрики bot_archive_*
+@metrics.instrument('bot_archive', 'method')
+class SessionArchiver:
+    """Холодный архив закрытых сессий
+
+    Неактивные сессии (закрытые администратором или по таймауту) вместе с
+    участниками и сообщениями переносятся из рабочей БД в сегменты - файлы,
+    в которые записи только дописываются. Каждая сессия - одна сжатая запись
+    JSON; тексты сообщений сохраняются как есть (зашифрованными).
+    Расположение записей - в таблице archive_index рабочей БД.
+
+    Новый сегмент начинается, когда текущий превысил segment_max_bytes или
+    его первой записи больше segment_days дней. Сегмент удаляется целиком,
+    когда самая новая запись в нем старше retention_days, - не позже чем
+    через retention_days + segment_days. read_session записи старше
+    retention_days не возвращает, поэтому архив доступен не дольше этого срока.
+    """
+    
+    def __init__(self, db, directory, retention_days=90, segment_max_bytes=64 * 1024 * 1024, batch_size=500,
+                 segment_days=1):
+        self.db = db
+        self.directory = Path(directory)
+        self.retention_days = retention_days
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_days = segment_days
+        self.batch_size = batch_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+    
+    def archive_inactive(self):
+        """Перенос всех неактивных сессий в архив. Возвращает количество сессий"""
+        total = 0
+        while True:
+            archived = self._archive_batch()
+            total += archived
+            if archived < self.batch_size:
+                return total
+    
+    def _archive_batch(self):
+        conn = self.db.connect()
+        try:
+            cursor = conn.cursor()
+            # Блокировка записи до конца переноса: новое сообщение в архивируемую
+            # сессию не потеряется между чтением и удалением
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT session_id, creator_user_id, created_at, last_activity
+                FROM sessions WHERE is_active = FALSE
+                LIMIT ?
+            ''', (self.batch_size,))
+            sessions = cursor.fetchall()
+            if not sessions:
+                conn.rollback()
+                return 0
+            
+            now = int(time.time())
+            entries = []
+            segment, path = self._current_segment(cursor, now)
+            with open(path, 'ab') as f:
+                for session_id, creator_id, created_at, last_activity in sessions:
+                    record = self._session_record(cursor, session_id)
+                    # Хеш ключ-фразы не архивируется: по нему ключ-фразу можно подобрать
+                    record.update({
+                        'session_id': session_id,
+                        'creator_user_id': creator_id,
+                        'created_at': created_at,
+                        'last_activity': last_activity,
+                        'archived_at': now,
+                    })
+                    payload = zlib.compress(json.dumps(record, separators=(',', ':')).encode('utf-8'), 6)
+                    offset = f.tell()
+                    f.write(FRAME.pack(FRAME_MAGIC, len(payload), zlib.crc32(payload)) + payload)
+                    entries.append((
+                        session_id, segment, offset, FRAME.size + len(payload),
+                        len(record['messages']), created_at, last_activity, now
+                    ))
+                # Данные на диске до удаления из БД
+                f.flush()
+                os.fsync(f.fileno())
+            
+            cursor.executemany('''
+                INSERT OR REPLACE INTO archive_index
+                    (session_id, segment, offset, length, message_count, created_at, last_activity, archived_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', entries)
+            session_ids = [(entry[0],) for entry in entries]
+            cursor.executemany('DELETE FROM messages WHERE session_id = ?', session_ids)
+            cursor.executemany('DELETE FROM participants WHERE session_id = ?', session_ids)
+            cursor.executemany('DELETE FROM sessions WHERE session_id = ?', session_ids)
+            conn.commit()
+            return len(entries)
+        finally:
+            conn.close()
+    
+    def _session_record(self, cursor, session_id):
+        cursor.execute('''
+            SELECT user_id, pseudonym, joined_at FROM participants WHERE session_id = ?
+        ''', (session_id,))
+        participants = [list(row) for row in cursor.fetchall()]
+        
+        cursor.execute('''
+            SELECT sender_type, timestamp, sender_pseudonym, message_text
+            FROM messages WHERE session_id = ?
+            ORDER BY message_id
+        ''', (session_id,))
+        messages = []
+        for sender_type, timestamp, pseudonym, text in cursor.fetchall():
+            # BLOB (сжатый/зашифрованный текст) - в base64 с пометкой
+            if isinstance(text, bytes):
+                messages.append([sender_type, timestamp, pseudonym, 'b', base64.b64encode(text).decode('ascii')])
+            else:
+                messages.append([sender_type, timestamp, pseudonym, 't', text])
+        return {'participants': participants, 'messages': messages}
+    
+    def _segments(self):
+        """Номера существующих сегментов по возрастанию"""
+        return sorted(int(path.stem) for path in self.directory.glob(f'*{SEGMENT_SUFFIX}') if path.stem.isdigit())
+    
+    def _segment_path(self, segment):
+        return self.directory / f'{segment:08d}{SEGMENT_SUFFIX}'
+    
+    def _current_segment(self, cursor, now):
+        """Сегмент для дописывания: последний, пока он не превысил segment_max_bytes
+        и его первая запись не старше segment_days
+        """
+        segments = self._segments()
+        if not segments:
+            return 1, self._segment_path(1)
+        
+        segment = segments[-1]
+        path = self._segment_path(segment)
+        cursor.execute('SELECT MIN(archived_at) FROM archive_index WHERE segment = ?', (segment,))
+        first_archived_at = cursor.fetchone()[0]
+        fresh = first_archived_at is None or now - first_archived_at < self.segment_days * 24 * 3600
+        if fresh and path.stat().st_size < self.segment_max_bytes:
+            return segment, path
+        return segment + 1, self._segment_path(segment + 1)
+    
+    def _cutoff(self):
+        """Время архивации, раньше которого записи считаются удаленными"""
+        return int(time.time()) - self.retention_days * 24 * 3600
+    
+    def read_session(self, session_id):
+        """Архивная запись сессии или None, если ее нет (или срок хранения истек)
+
+        Сообщения - [(sender_type, timestamp, pseudonym, значение из БД), ...];
+        значение расшифровывается через AnonymousDatabase.codec.
+        """
+        conn = self.db.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT segment, offset, length, archived_at FROM archive_index WHERE session_id = ?
+        ''', (session_id,))
+        location = cursor.fetchone()
+        conn.close()
+        # Запись с истекшим сроком хранения ждет удаления вместе со своим сегментом
+        if location is None or location[3] < self._cutoff():
+            return None
+        
+        segment, offset, length, archived_at = location
+        try:
+            with open(self._segment_path(segment), 'rb') as f:
+                f.seek(offset)
+                frame = f.read(length)
+        except FileNotFoundError:
+            return None
+        
+        if len(frame) < FRAME.size:
+            raise ArchiveCorruptedError(f"Archive record of session {session_id} is truncated")
+        magic, size, checksum = FRAME.unpack_from(frame)
+        payload = frame[FRAME.size:]
+        if magic != FRAME_MAGIC or size != len(payload) or zlib.crc32(payload) != checksum:
+            raise ArchiveCorruptedError(f"Archive record of session {session_id} is corrupted")
+        
+        record = json.loads(zlib.decompress(payload))
+        # Записи, архивированные до удаления хеша ключ-фразы из архива
+        record.pop('passphrase_hash', None)
+        record['messages'] = [
+            (sender_type, timestamp, pseudonym, base64.b64decode(value) if kind == 'b' else value)
+            for sender_type, timestamp, pseudonym, kind, value in record['messages']
+        ]
+        record['participants'] = [tuple(row) for row in record['participants']]
+        return record
+    
+    def enforce_retention(self):
+        """Удаление сегментов, все записи которых старше retention_days. Возвращает число сегментов"""
+        cutoff = self._cutoff()
+        conn = self.db.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT segment FROM archive_index
+            GROUP BY segment HAVING MAX(archived_at) < ?
+        ''', (cutoff,))
+        expired = [row[0] for row in cursor.fetchall()]
+        
+        for segment in expired:
+            # Сначала индекс: запись без файла - это "нет в архиве", файл без записей - мусор
+            cursor.execute('DELETE FROM archive_index WHERE segment = ?', (segment,))
+            conn.commit()
+            self._segment_path(segment).unlink(missing_ok=True)
+        
+        # Сегменты без записей в индексе (запись прервана до фиксации в БД)
+        cursor.execute('SELECT DISTINCT segment FROM archive_index')
+        indexed = {row[0] for row in cursor.fetchall()}
+        conn.close()
+        for segment in self._segments()[:-1]:
+            path = self._segment_path(segment)
+            if segment not in indexed and path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+        
+        if expired:
+            logger.info(f"Removed {len(expired)} archive segments older than {self.retention_days} days")
+        return len(expired)
+    
+    def get_stats(self):
+        """Размер архива: {'sessions', 'messages', 'segments', 'bytes'}"""
+        conn = self.db.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(message_count), 0) FROM archive_index')
+        sessions, messages = cursor.fetchone()
+        conn.close()
+        
+        segments = self._segments()
+        size = sum(self._segment_path(segment).stat().st_size for segment in segments)
+        return {'sessions': sessions, 'messages': messages, 'segments': len(segments), 'bytes': size}
@@ -0,0 +1,353 @@
+"""Бенчмарк AnonymousDatabase на синтетических данных продакшен-объема
+
+Примеры:
+    python benchmarks/bench_database.py --size 10k --output before.json
+    python benchmarks/bench_database.py --size 10k --output after.json --compare before.json
+
+Набор данных генерируется детерминированно (--seed) и кэшируется в
+--data-dir, поэтому повторные прогоны сравнимы между собой. Результаты
+пишутся в JSON: пропускная способность для операций записи и перцентили
+задержки для чтения.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from config import MESSAGE_COMPRESSION  # noqa: E402
+from crypto import SessionCipher, derive_passphrase_lookup, derive_session_key  # noqa: E402
+from database import (  # noqa: E402
+    AnonymousDatabase, PASSPHRASE_HASH_PREFIX, SCHEMA_VERSION, SENDER_CREATOR, SENDER_RESPONDER, WORDS
+)
+from search import SearchTokenizer  # noqa: E402
+
+# Размер набора: (сессий, сообщений)
+SIZES = {
+    '10k': (10_000, 100_000),
+    '100k': (100_000, 1_000_000),
+    '1m': (1_000_000, 10_000_000),
+}
+
+BATCH_SIZE = 50_000
+
+# Поисковый индекс синтетических сообщений строится с постоянным ключом
+BENCH_SEARCH_KEY = 'bench-search-key'
+BENCH_SEARCH = SearchTokenizer(BENCH_SEARCH_KEY)
+
+
+def bench_passphrase(index):
+    """Известная ключ-фраза синтетической сессии (для join_session)"""
+    return f'bench-{index}-alpha-bravo-charlie-delta'
+
+
+def bench_cipher(session_id, seed):
+    """Ключ синтетической сессии: без scrypt, иначе генерация заняла бы часы"""
+    return SessionCipher(hashlib.sha256(f'{seed}-{session_id}'.encode()).digest(), session_id)
+
+
+def bench_passphrase_hash(passphrase):
+    """Хеш ключ-фразы синтетической сессии: без scrypt по той же причине"""
+    return PASSPHRASE_HASH_PREFIX + hashlib.sha256(passphrase.encode()).hexdigest()
+
+
+class BenchDatabase(AnonymousDatabase):
+    """AnonymousDatabase с дешевым хешем ключ-фраз (стоимость scrypt - в бенчмарке derive_passphrase_lookup)"""
+    
+    def _hash_passphrase(self, passphrase):
+        return bench_passphrase_hash(passphrase)
+
+
+def generate_dataset(path, sessions, messages, seed):
+    """Заполнение БД синтетическими сессиями, участниками и сообщениями"""
+    rng = random.Random(seed)
+    codec = AnonymousDatabase(str(path), search_key=BENCH_SEARCH_KEY).codec  # Создание схемы и миграции
+    
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    
+    now = int(time.time())
+    users = max(sessions // 2, 1)
+    session_ids = []
+    ciphers = {}
+    
+    def timestamp(max_hours):
+        return now - rng.randrange(max_hours * 3600)
+    
+    def text(length):
+        # Слова вместо однородного заполнителя: сжатие работает как на живой переписке
+        words = []
+        while sum(len(word) + 1 for word in words) < length:
+            words.append(rng.choice(WORDS))
+        return ' '.join(words)
+    
+    rows, participants = [], []
+    for i in range(sessions):
+        session_id = f'{rng.getrandbits(128):032x}'
+        session_ids.append(session_id)
+        ciphers[session_id] = bench_cipher(session_id, seed)
+        passphrase_hash = bench_passphrase_hash(bench_passphrase(i))
+        creator, responder = rng.randrange(users), rng.randrange(users)
+        created = timestamp(72)
+        # Примерно треть сессий старше 24 часов - работа для cleanup_old_sessions
+        rows.append((session_id, passphrase_hash, creator, created, timestamp(36), True))
+        participants.append((session_id, creator, 'Creator'))
+        if responder != creator:
+            participants.append((session_id, responder, 'Responder'))
+        if len(rows) >= BATCH_SIZE:
+            _flush_sessions(conn, rows, participants)
+    _flush_sessions(conn, rows, participants)
+    
+    batch, documents = [], []
+    for message_id in range(1, messages + 1):
+        # Степенное распределение: у небольшой части сессий длинная история
+        session_id = session_ids[int(sessions * rng.random() ** 3)]
+        sender = rng.random() < 0.5
+        body = text(rng.randrange(5, 200))
+        batch.append((
+            message_id,
+            session_id,
+            SENDER_CREATOR if sender else SENDER_RESPONDER,
+            codec.encode(body, ciphers[session_id]),
+            timestamp(36),
+            'Creator' if sender else 'Responder'
+        ))
+        documents.append((message_id, BENCH_SEARCH.document(body)))
+        if len(batch) >= BATCH_SIZE:
+            _flush_messages(conn, batch, documents)
+    _flush_messages(conn, batch, documents)
+    
+    # Счетчики сообщений поддерживает add_message, здесь сообщения вставлены напрямую
+    conn.execute('''
+        UPDATE sessions SET message_count =
+            (SELECT COUNT(*) FROM messages m WHERE m.session_id = sessions.session_id)
+    ''')
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    return session_ids
+
+
+def _flush_sessions(conn, rows, participants):
+    conn.executemany('''
+        INSERT INTO sessions (session_id, passphrase_hash, creator_user_id, created_at, last_activity, is_active)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.executemany('''
+        INSERT OR IGNORE INTO participants (session_id, user_id, pseudonym) VALUES (?, ?, ?)
+    ''', participants)
+    rows.clear()
+    participants.clear()
+
+
+def _flush_messages(conn, batch, documents):
+    conn.executemany('''
+        INSERT INTO messages (message_id, session_id, sender_type, message_text, timestamp, sender_pseudonym)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', batch)
+    conn.executemany('INSERT INTO message_search (rowid, tokens) VALUES (?, ?)', documents)
+    batch.clear()
+    documents.clear()
+
+
+def latency_stats(samples):
+    """Сводка задержек в миллисекундах"""
+    samples = sorted(samples)
+    
+    def pick(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    
+    return {
+        'ops': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'min_ms': samples[0] * 1000,
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+def measure(func, arguments):
+    """Вызов func для каждого набора аргументов с замером времени"""
+    samples = []
+    for args in arguments:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    stats = latency_stats(samples)
+    stats['ops_per_sec'] = len(samples) / sum(samples) if sum(samples) else 0.0
+    return stats
+
+
+def run_benchmarks(db, session_ids, sessions, ops, seed):
+    rng = random.Random(seed + 1)
+    users = max(sessions // 2, 1)
+    results = {}
+    ciphers = {}
+    
+    def cipher(session_id):
+        if session_id not in ciphers:
+            ciphers[session_id] = bench_cipher(session_id, seed)
+        return ciphers[session_id]
+    
+    def bench(name, func, arguments):
+        print(f'  {name}...', file=sys.stderr, flush=True)
+        results[name] = measure(func, arguments)
+    
+    # Чтение (до операций записи, чтобы данные были одинаковыми)
+    sample = [(sid, None, cipher(sid)) for sid in (rng.choice(session_ids) for _ in range(ops))]
+    bench('get_session_messages', db.get_session_messages, sample)
+    # Самая длинная история: сессии с малыми индексами самые "горячие"
+    hot = session_ids[0]
+    bench('get_session_messages_hot', db.get_session_messages, [(hot, None, cipher(hot))] * min(ops, 20))
+    bench('get_session_messages_hot_last20', db.get_session_messages, [(hot, 20, cipher(hot))] * min(ops, 20))
+    bench('get_user_active_sessions', db.get_user_active_sessions,
+          [(rng.randrange(users),) for _ in range(ops)])
+    heavy_ops = max(3, min(ops // 100, 20))
+    bench('get_system_stats', db.get_system_stats, [()] * heavy_ops)
+    # Вывод ключа из ключ-фразы: при создании сессии, входе и разблокировке после перезапуска
+    bench('derive_session_key', derive_session_key,
+          [(bench_passphrase(i), session_ids[i]) for i in range(heavy_ops)])
+    # Хеш ключ-фразы для поиска сессии: при создании сессии и входе по ключ-фразе
+    bench('derive_passphrase_lookup', derive_passphrase_lookup,
+          [(bench_passphrase(i),) for i in range(heavy_ops)])
+    bench('get_all_active_sessions_with_stats', db.get_all_active_sessions_with_stats, [()] * heavy_ops)
+    for order in ('activity', 'messages'):
+        # Курсоры первых страниц списка, как при листании в админке
+        keys, key = [None], None
+        while len(keys) < min(ops, 50):
+            rows, has_more = db.get_active_sessions_page(order, key)
+            if not has_more:
+                break
+            last = rows[-1]
+            key = (last[4] if order == 'activity' else last[5], last[0])
+            keys.append(key)
+        bench(f'get_active_sessions_page_{order}', db.get_active_sessions_page,
+              [(order, keys[i % len(keys)]) for i in range(ops)])
+    # Поиск в админке: одно слово (много совпадений) и два слова (пересечение)
+    bench('search_messages_word', db.search_messages,
+          [(BENCH_SEARCH.tokens(rng.choice(WORDS)),) for _ in range(ops)])
+    bench('search_messages_two_words', db.search_messages,
+          [(BENCH_SEARCH.tokens(f'{rng.choice(WORDS)} {rng.choice(WORDS)}'),) for _ in range(ops)])
+    
+    # Запись
+    messages = [' '.join(rng.choice(WORDS) for _ in range(rng.randrange(1, 30))) for _ in range(ops)]
+    bench('create_session', db.create_session, [(users + i,) for i in range(ops)])
+    bench('join_session', db.join_session,
+          [(bench_passphrase(rng.randrange(sessions)), users * 2 + i) for i in range(ops)])
+    targets = [rng.choice(session_ids) for _ in messages]
+    bench('add_message', db.add_message,
+          [(sid, SENDER_RESPONDER, text, 'Responder', cipher(sid)) for sid, text in zip(targets, messages)])
+    
+    # Очистка меняет данные, поэтому последней
+    bench('cleanup_old_sessions', db.cleanup_old_sessions, [()])
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Печать изменения относительно предыдущего прогона"""
+    baseline = json.loads(Path(baseline_path).read_text())['results']
+    print(f'\n{"benchmark":40} {"baseline":>12} {"current":>12} {"change":>8}')
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        before, after = previous['p50_ms'], current['p50_ms']
+        change = (after - before) / before * 100 if before else 0.0
+        print(f'{name:40} {before:10.3f}ms {after:10.3f}ms {change:+7.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AnonymousDatabase benchmark')
+    parser.add_argument('--size', choices=SIZES, default='10k')
+    parser.add_argument('--ops', type=int, default=1000, help='operations per benchmark')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', default=str(ROOT / '.bench-data'))
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    args = parser.parse_args()
+    
+    sessions, messages = SIZES[args.size]
+    data_dir = Path(args.data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    # Кэш набора данных зависит от размера, seed, версии схемы и сжатия сообщений
+    template = data_dir / f'{args.size}-seed{args.seed}-v{SCHEMA_VERSION}-{MESSAGE_COMPRESSION}-aesgcm-s1.db'
+    ids_file = template.with_suffix('.ids')
+    
+    if not template.exists() or not ids_file.exists():
+        print(f'Generating dataset {template.name} ({sessions} sessions, {messages} messages)...',
+              file=sys.stderr)
+        start = time.perf_counter()
+        partial = template.with_suffix('.tmp')
+        if partial.exists():
+            partial.unlink()
+        session_ids = generate_dataset(partial, sessions, messages, args.seed)
+        ids_file.write_text('\n'.join(session_ids))
+        os.replace(partial, template)
+        print(f'Generated in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+    session_ids = ids_file.read_text().split('\n')
+    
+    # Бенчмарк изменяет данные, поэтому работаем с копией
+    work = data_dir / 'work.db'
+    shutil.copyfile(template, work)
+    print(f'Running benchmarks on {args.size} dataset...', file=sys.stderr)
+    db = BenchDatabase(str(work), search_key=BENCH_SEARCH_KEY)
+    results = run_benchmarks(db, session_ids, sessions, args.ops, args.seed)
+    db_size = work.stat().st_size
+    work.unlink()
+    
+    report = {
+        'meta': {
+            'size': args.size,
+            'sessions': sessions,
+            'messages': messages,
+            'ops': args.ops,
+            'seed': args.seed,
+            'schema_version': SCHEMA_VERSION,
+            'message_compression': MESSAGE_COMPRESSION,
+            'db_size_bytes': db_size,
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+    
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+    
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,43 @@
-import sqlite3
+import asyncio
+import base64
+import io
+import json
 import logging
 import threading
 import time
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler,
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler,
     ContextTypes, filters
 )
 
-from config import BOT_TOKEN, ADMIN_IDS, MAX_MESSAGE_LENGTH, MAX_SESSIONS_PER_USER
-from database import AnonymousDatabase
+from config import (
+    MAX_MESSAGE_LENGTH, MAX_SESSIONS_PER_USER, SESSION_TIMEOUT_HOURS,
+    MAX_SESSION_PARTICIPANTS, ADMIN_SESSIONS_PAGE_SIZE, LOOP_LAG_THRESHOLD_MS,
+    SESSION_KEY_CACHE_SIZE, ARCHIVE_RETENTION_DAYS, ARCHIVE_SEGMENT_MB, ARCHIVE_SEGMENT_DAYS,
+    UPDATE_DEDUP_WINDOW, STATE_FLUSH_INTERVAL, ADMIN_SEARCH_PAGE_SIZE, SHUTDOWN_DRAIN_TIMEOUT
+)
+from archive import SessionArchiver
+from crypto import DecryptionError, SessionCipher, SessionKeyCache
+from database import (
+    AnonymousDatabase, PASSPHRASE_WORDS, SENDER_CREATOR, SENDER_RESPONDER, SessionFullError
+)
+from host import BotHost
+from metrics import metrics
+from outbound import InstrumentedRequest
+from persistence import SQLitePersistence, UpdateContext
+from recorder import UpdateRecorder
+from router import CallbackRoute, CallbackRouter, INT, SESSION_ID, choice
+from routing import SessionRegistry
+from screens import (
+    WELCOME_TEXT, MAIN_MENU_TEXT, HELP_TEXT, HELP_TEXT_SEARCH, ASK_PASSPHRASE_TEXT, ADMIN_PANEL_TEXT,
+    MAIN_MENU_KEYBOARD, ADMIN_MAIN_MENU_KEYBOARD, BACK_TO_MENU_KEYBOARD, ADMIN_PANEL_KEYBOARD,
+    BACK_TO_ADMIN_PANEL_KEYBOARD, ADMIN_STATS_KEYBOARD, ADMIN_PERFORMANCE_KEYBOARD,
+    ADMIN_SLOW_QUERIES_KEYBOARD, ADMIN_SESSION_CLOSED_KEYBOARD, BROADCAST_CANCEL_KEYBOARD,
+    CLEANUP_DONE_KEYBOARD
+)
+from tenants import default_tenant, load_tenants
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,92 +46,124 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Кнопки с параметрами: '<версия><код>:<поле>...' (см. router.py)
+SESSION_ORDER = choice(a='activity', m='messages')
+PAGE_DIRECTION = choice(p='prev', n='next')
+ENTER_SESSION = CallbackRoute('e', SESSION_ID)
+ADMIN_VIEW_SESSION = CallbackRoute('v', SESSION_ID)
+ADMIN_CLOSE_SESSION = CallbackRoute('c', SESSION_ID)
+# Список сессий в админке: порядок сортировки / страница с курсором (значение, rowid)
+ADMIN_SESSIONS_ORDER = CallbackRoute('o', SESSION_ORDER)
+ADMIN_SESSIONS_PAGE = CallbackRoute('p', SESSION_ORDER, PAGE_DIRECTION, INT, INT)
+# Страница результатов поиска: курсор - message_id (сам запрос - в user_data)
+ADMIN_SEARCH_PAGE = CallbackRoute('s', PAGE_DIRECTION, INT)
+
+
+def _legacy_session_id(rest):
+    """session_<id>, admin_session_view_<id>: id - до следующего '_'"""
+    return (SESSION_ID.decode(rest.split('_')[0]),)
+
+
+def _legacy_sessions_page(rest):
+    """admin_sessions|<a|m>[|<n|p>|<значение>|<rowid>]"""
+    parts = rest.split('|')
+    if len(parts) == 4:
+        return (SESSION_ORDER.decode(parts[0]), (int(parts[2]), int(parts[3])), PAGE_DIRECTION.decode(parts[1]))
+    return (SESSION_ORDER.decode(parts[0]),)
+
+
+# Время и ошибки каждого асинхронного обработчика попадают в метрики bot_handler_*
+@metrics.instrument('bot_handler', 'handler', coroutines_only=True)
 class AnonymousBot:
-    def __init__(self):
-        self.db = AnonymousDatabase()
-        self.user_sessions = {}  # {user_id: session_id}
-        self.session_users = {}  # {session_id: [user_id1, user_id2]}
+    def __init__(self, db=None, tenant=None, host=None):
+        # Токен, администраторы, файлы БД и архива этого бота
+        self.tenant = tenant or default_tenant()
+        # Пустой search_key бота отключает поиск (без подстановки общего SEARCH_INDEX_KEY)
+        self.db = db or AnonymousDatabase(self.tenant.db_path, search_key=self.tenant.search_key)
+        # Общие с другими ботами процесса пул отправки, сторож цикла и метрики
+        self.host = host or BotHost()
+        self.host.add(self)
+        self.outbound = self.host.outbound
+        self.watchdog = self.host.watchdog
+        # Маршруты в памяти: {user_id: session_id} и {session_id: участники}
+        self.routing = SessionRegistry(idle_timeout=SESSION_TIMEOUT_HOURS * 3600)
         self.application = None
+        # Таблица маршрутов кнопок
+        self.router = self.build_router()
+        # user_data и окно обработанных update_id переживают перезапуск
+        self.persistence = SQLitePersistence(self.db, UPDATE_DEDUP_WINDOW, STATE_FLUSH_INTERVAL)
+        self.persistence_task = None
+        # Фоновая очистка и перенос в архив (поток) и сигнал ее остановки
+        self.cleanup_thread = None
+        self.stopping = threading.Event()
+        # Ключи шифрования сообщений активных сессий (выводятся из ключ-фразы)
+        self.session_keys = SessionKeyCache(SESSION_KEY_CACHE_SIZE)
+        # Холодный архив закрытых сессий (ARCHIVE_DIR пустой - архив отключен)
+        self.archiver = SessionArchiver(
+            self.db, self.tenant.archive_dir, ARCHIVE_RETENTION_DAYS, ARCHIVE_SEGMENT_MB * 1024 * 1024,
+            segment_days=ARCHIVE_SEGMENT_DAYS
+        ) if self.tenant.archive_dir else None
+        # Запись входящих апдейтов для воспроизведения нагрузки (по желанию)
+        self.recorder = UpdateRecorder(
+            self.tenant.record_path, self.tenant.admin_ids
+        ) if self.tenant.record_path else None
     
     def is_admin(self, user_id):
-        """Проверка, является ли пользователь администратором"""
-        return user_id in ADMIN_IDS
+        """Проверка, является ли пользователь администратором этого бота"""
+        return user_id in self.tenant.admin_ids
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
-        user_id = update.effective_user.id
-        
-        keyboard = [
-            [InlineKeyboardButton("📝 Create Chat", callback_data="create_session")],
-            [InlineKeyboardButton("🔑 Join Chat", callback_data="join_session")],
-            [InlineKeyboardButton("📋 My Chats", callback_data="my_sessions")],
-            [InlineKeyboardButton("❓ Help", callback_data="help")]
-        ]
-        
-        # Добавляем кнопку админа если пользователь админ
-        if self.is_admin(user_id):
-            keyboard.append([InlineKeyboardButton("👑 Admin Panel", callback_data="admin_panel")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        welcome_text = """
-🤫 Welcome to the anonymous messaging bot!
-
-🔒 Features:
-• Complete anonymity - we don't store message logs
-• Secure connection
-• Automatic deletion after 24 hours
-
-📖 How to use:
-1. Create a chat and get a passphrase
-2. Share the passphrase with your partner
-3. Start anonymous conversation
-
-Choose an action:
-        """
-        
-        await update.message.reply_text(welcome_text.strip(), reply_markup=reply_markup)
+        self.cancel_passphrase_prompt(context)
+        await update.message.reply_text(WELCOME_TEXT, reply_markup=self.main_menu_keyboard(update.effective_user.id))
+    
+    def main_menu_keyboard(self, user_id):
+        """Главное меню (с кнопкой админ-панели для администраторов)"""
+        return ADMIN_MAIN_MENU_KEYBOARD if self.is_admin(user_id) else MAIN_MENU_KEYBOARD
     
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик нажатий кнопок"""
+        """Обработчик нажатий кнопок: поиск обработчика в таблице маршрутов"""
         query = update.callback_query
         await query.answer()
         
-        user_id = query.from_user.id
-        data = query.data
-        
-        if data == "create_session":
-            await self.create_session(query, context)
-        elif data == "join_session":
-            await self.ask_passphrase(query, context)
-        elif data == "my_sessions":
-            await self.show_my_sessions(query, context)
-        elif data == "help":
-            await self.show_help(query, context)
-        elif data.startswith("session_"):
-            session_id = data.split("_")[1]
-            await self.enter_session(query, context, session_id)
-        elif data == "back_to_menu":
-            await self.show_main_menu(query, context)
+        resolved = self.router.resolve(query.data or "")
+        if resolved is None:
+            logger.debug(f"Unknown callback data: {query.data!r}")
+            return
+        handler, arguments = resolved
+        await handler(query, context, *arguments)
+    
+    def build_router(self):
+        """Таблица маршрутов кнопок"""
+        router = CallbackRouter()
+        
+        router.add("create_session", self.create_session)
+        router.add("join_session", self.ask_passphrase)
+        router.add("my_sessions", self.show_my_sessions)
+        router.add("help", self.show_help)
+        router.add("back_to_menu", self.show_main_menu)
+        router.add_route(ENTER_SESSION, self.enter_session)
         
         # Админские функции
-        elif data == "admin_panel":
-            await self.show_admin_panel(query, context)
-        elif data == "admin_stats":
-            await self.show_admin_stats(query, context)
-        elif data == "admin_active_sessions":
-            await self.show_admin_active_sessions(query, context)
-        elif data == "admin_broadcast":
-            await self.ask_broadcast_message(query, context)
-        elif data == "admin_cleanup":
-            await self.force_cleanup(query, context)
-        elif data.startswith("admin_session_"):
-            session_action = data.split("_")[2]
-            session_id = data.split("_")[3]
-            if session_action == "view":
-                await self.admin_view_session(query, context, session_id)
-            elif session_action == "close":
-                await self.admin_close_session(query, context, session_id)
+        router.add("admin_panel", self.show_admin_panel)
+        router.add("admin_stats", self.show_admin_stats)
+        router.add("admin_performance", self.show_admin_performance)
+        router.add("admin_slow_queries", self.show_admin_slow_queries)
+        router.add("admin_active_sessions", self.show_admin_active_sessions)
+        router.add("admin_broadcast", self.ask_broadcast_message)
+        router.add("admin_cleanup", self.force_cleanup)
+        router.add_route(ADMIN_SESSIONS_ORDER, self.show_admin_active_sessions)
+        router.add_route(ADMIN_SESSIONS_PAGE, self.show_admin_sessions_page)
+        router.add_route(ADMIN_VIEW_SESSION, self.admin_view_session)
+        router.add_route(ADMIN_CLOSE_SESSION, self.admin_close_session)
+        router.add_route(ADMIN_SEARCH_PAGE, self.show_admin_search_page)
+        
+        # Кнопки прежнего формата в уже отправленных сообщениях
+        router.add_legacy("session_", self.enter_session, _legacy_session_id)
+        router.add_legacy("admin_session_view_", self.admin_view_session, _legacy_session_id)
+        router.add_legacy("admin_session_close_", self.admin_close_session, _legacy_session_id)
+        router.add_legacy("admin_sessions|", self.show_admin_active_sessions, _legacy_sessions_page)
+        return router
     
     async def show_admin_panel(self, query, context):
         """Показать панель администратора"""
@@ -114,26 +173,7 @@ Choose an action:
             await query.edit_message_text("❌ Access denied.")
             return
         
-        keyboard = [
-            [InlineKeyboardButton("📊 Statistics", callback_data="admin_stats")],
-            [InlineKeyboardButton("💬 Active Sessions", callback_data="admin_active_sessions")],
-            [InlineKeyboardButton("📢 Broadcast Message", callback_data="admin_broadcast")],
-            [InlineKeyboardButton("🧹 Force Cleanup", callback_data="admin_cleanup")],
-            [InlineKeyboardButton("🔙 Back to Main Menu", callback_data="back_to_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        admin_text = """
-👑 Admin Panel
-
-Choose an action:
-• 📊 Statistics - View bot usage statistics
-• 💬 Active Sessions - View and manage active sessions
-• 📢 Broadcast - Send message to all users
-• 🧹 Cleanup - Force cleanup of old sessions
-        """
-        
-        await query.edit_message_text(admin_text.strip(), reply_markup=reply_markup)
+        await query.edit_message_text(ADMIN_PANEL_TEXT, reply_markup=ADMIN_PANEL_KEYBOARD)
     
     async def show_admin_stats(self, query, context):
         """Показать статистику"""
@@ -145,13 +185,24 @@ Choose an action:
         
         # Получаем статистику из базы данных
         stats = self.db.get_system_stats()
+        lag_p50, lag_p95, lag_p99 = self.watchdog.lag_summary()
+        archive_text = "• Disabled"
+        if self.archiver:
+            archive = self.archiver.get_stats()
+            archive_text = (
+                f"• Archived sessions: {archive['sessions']} ({archive['messages']} messages)\n"
+                f"• Segments: {archive['segments']}, {archive['bytes'] / 1024 / 1024:.1f} MB\n"
+                f"• Retention: {ARCHIVE_RETENTION_DAYS} days"
+            )
         
         stats_text = f"""
 📊 System Statistics
 
 🤖 Bot Information:
-• Active users in memory: {len(self.user_sessions)}
-• Active sessions in memory: {len(self.session_users)}
+• Active users in memory: {self.routing.user_count}
+• Active sessions in memory: {self.routing.session_count}
+• Routing memory: {self.routing.memory_usage() / 1024:.1f} KB
+• Session keys in memory: {len(self.session_keys)}
 
 💾 Database Information:
 • Total active sessions: {stats['total_sessions']}
@@ -164,58 +215,177 @@ Choose an action:
 • Messages today: {stats['messages_today']}
 • Average messages per session: {stats['avg_messages_per_session']}
 
+🗄 Archive:
+{archive_text}
+
+⏱ Event Loop:
+• Lag p50/p95/p99: {lag_p50 * 1000:.1f}/{lag_p95 * 1000:.1f}/{lag_p99 * 1000:.1f} ms
+• Stalls over {LOOP_LAG_THRESHOLD_MS} ms: {self.watchdog.stalls}
+
 🕐 Last update: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
         """
         
-        keyboard = [
-            [InlineKeyboardButton("🔄 Refresh", callback_data="admin_stats")],
-            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(stats_text.strip(), reply_markup=ADMIN_STATS_KEYBOARD)
+    
+    async def show_admin_performance(self, query, context):
+        """Показать метрики производительности"""
+        user_id = query.from_user.id
         
-        await query.edit_message_text(stats_text.strip(), reply_markup=reply_markup)
+        if not self.is_admin(user_id):
+            await query.edit_message_text("❌ Access denied.")
+            return
+        
+        gauges = metrics.gauge_values()
+        
+        performance_text = f"""
+⚡ Performance
+
+Format: calls · p50/p95/p99 ms · errors
+
+🤖 Handlers:
+{self.format_latency_rows(metrics.summary('bot_handler'))}
+
+💾 Database:
+{self.format_latency_rows(metrics.summary('bot_db'))}
+
+📡 Telegram API:
+{self.format_latency_rows(metrics.summary('bot_telegram'))}
+
+📬 Queues:
+• Outbound in flight: {gauges.get('bot_outbound_in_flight', 0)}
+• Outbound waiting: {gauges.get('bot_outbound_pending', 0)}
+• Incoming updates: {gauges.get('bot_update_queue_size', 0)}
+
+🕐 Last update: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        """
+        
+        await query.edit_message_text(performance_text.strip(), reply_markup=ADMIN_PERFORMANCE_KEYBOARD)
     
-    async def show_admin_active_sessions(self, query, context):
-        """Показать активные сессии для админа"""
+    async def show_admin_slow_queries(self, query, context):
+        """Показать статистику SQL-запросов из профилировщика"""
         user_id = query.from_user.id
         
         if not self.is_admin(user_id):
             await query.edit_message_text("❌ Access denied.")
             return
         
-        active_sessions = self.db.get_all_active_sessions_with_stats()
+        reply_markup = ADMIN_SLOW_QUERIES_KEYBOARD
         
-        if not active_sessions:
+        if self.db.profiler is None:
+            await query.edit_message_text(
+                "🐢 Query profiler is disabled.\n\n"
+                "Set QUERY_PROFILER=1 in .env and restart the bot to collect query statistics.",
+                reply_markup=reply_markup
+            )
+            return
+        
+        rows = self.db.profiler.top(6)
+        if not rows:
+            await query.edit_message_text("🐢 No queries recorded yet.", reply_markup=reply_markup)
+            return
+        
+        blocks = []
+        for sql, count, total, avg, max_time, slow_count, plan in rows:
+            block = (
+                f"• {sql[:150]}\n"
+                f"  calls {count} · total {total * 1000:.0f} ms · avg {avg * 1000:.1f} ms · "
+                f"max {max_time * 1000:.1f} ms · slow {slow_count}"
+            )
+            if plan:
+                block += f"\n  plan: {plan[:150]}"
+            blocks.append(block)
+        
+        # Ограничение Telegram на длину сообщения
+        slow_text = ("🐢 Top queries by total time:\n\n" + "\n\n".join(blocks))[:4000]
+        
+        await query.edit_message_text(slow_text, reply_markup=reply_markup)
+    
+    def format_latency_rows(self, rows, limit=8):
+        """Строки сводки задержек (самые затратные сверху)"""
+        if not rows:
+            return "• No data yet"
+        
+        lines = []
+        for name, count, errors, p50, p95, p99 in rows[:limit]:
+            error_rate = errors / count * 100 if count else 0
+            lines.append(
+                f"• {name}: {count} · {p50 * 1000:.1f}/{p95 * 1000:.1f}/{p99 * 1000:.1f} · {error_rate:.1f}%"
+            )
+        return "\n".join(lines)
+    
+    async def show_admin_active_sessions(self, query, context, order='activity', key=None, direction='next'):
+        """Показать активные сессии для админа (постранично)"""
+        user_id = query.from_user.id
+        
+        if not self.is_admin(user_id):
+            await query.edit_message_text("❌ Access denied.")
+            return
+        
+        sessions, has_more = self.db.get_active_sessions_page(order, key, direction, ADMIN_SESSIONS_PAGE_SIZE)
+        if not sessions and key is not None:
+            # Страница опустела (сессии закрыты) - начинаем сначала
+            key, direction = None, 'next'
+            sessions, has_more = self.db.get_active_sessions_page(order, limit=ADMIN_SESSIONS_PAGE_SIZE)
+        
+        if not sessions:
             await query.edit_message_text("📭 No active sessions found.")
             return
         
         keyboard = []
-        for session in active_sessions[:15]:  # Ограничиваем показ
-            session_id = session[0]
-            creator_id = session[1]
-            message_count = session[4]
-            
+        for rowid, session_id, creator_id, created_at, last_activity, message_count in sessions:
             # Получаем количество участников из памяти
-            user_count = len(self.session_users.get(session_id, []))
+            user_count = self.routing.member_count(session_id)
             
             keyboard.append([
                 InlineKeyboardButton(
                     f"💬 {session_id[:8]}... (👥{user_count} 📝{message_count})", 
-                    callback_data=f"admin_session_view_{session_id}"
+                    callback_data=ADMIN_VIEW_SESSION.encode(session_id)
                 )
             ])
         
-        keyboard.append([InlineKeyboardButton("🔄 Refresh", callback_data="admin_active_sessions")])
+        # Курсоры страниц: значение сортировки и rowid крайних строк
+        column = 4 if order == 'activity' else 5
+        has_prev = has_more if direction == 'prev' else key is not None
+        has_next = has_more if direction == 'next' else True
+        navigation = []
+        if has_prev:
+            first = sessions[0]
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Prev", callback_data=ADMIN_SESSIONS_PAGE.encode(order, 'prev', first[column], first[0])
+            ))
+        if has_next:
+            last = sessions[-1]
+            navigation.append(InlineKeyboardButton(
+                "Next ➡️", callback_data=ADMIN_SESSIONS_PAGE.encode(order, 'next', last[column], last[0])
+            ))
+        if navigation:
+            keyboard.append(navigation)
+        
+        keyboard.append([
+            InlineKeyboardButton(
+                ("✅ " if order == 'activity' else "") + "🕐 By activity",
+                callback_data=ADMIN_SESSIONS_ORDER.encode('activity')
+            ),
+            InlineKeyboardButton(
+                ("✅ " if order == 'messages' else "") + "📝 By messages",
+                callback_data=ADMIN_SESSIONS_ORDER.encode('messages')
+            )
+        ])
+        keyboard.append([InlineKeyboardButton("🔄 Refresh", callback_data=ADMIN_SESSIONS_ORDER.encode(order))])
         keyboard.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(
-            f"💬 Active Sessions ({len(active_sessions)}):\n\n"
+            f"💬 Active Sessions (by {'last activity' if order == 'activity' else 'message count'}):\n\n"
             "Format: SessionID (Participants Messages)\n"
             "Click to view details:",
             reply_markup=reply_markup
         )
     
+    async def show_admin_sessions_page(self, query, context, order, direction, value, rowid):
+        """Страница списка сессий по курсору из кнопки Prev/Next"""
+        await self.show_admin_active_sessions(query, context, order, (value, rowid), direction)
+    
     async def admin_view_session(self, query, context, session_id):
         """Просмотр деталей сессии для админа"""
         user_id = query.from_user.id
@@ -227,7 +397,15 @@ Choose an action:
         session_info = self.get_session_details(session_id)
         
         if not session_info:
-            await query.edit_message_text("❌ Session not found.")
+            # Чтение и распаковка записи архива - вне цикла событий
+            record = await asyncio.to_thread(self.archiver.read_session, session_id) if self.archiver else None
+            if record is None:
+                await query.edit_message_text("❌ Session not found.")
+                return
+            await query.edit_message_text(
+                self.format_archive_record(record) + f"\n\n📦 Export: /archive {session_id}",
+                reply_markup=BACK_TO_ADMIN_PANEL_KEYBOARD
+            )
             return
         
         session_text = f"""
@@ -237,15 +415,15 @@ Choose an action:
 👤 Creator: {session_info['creator_id']}
 👥 Participants: {len(session_info['participants'])}
 📝 Messages: {session_info['message_count']}
-🕐 Created: {session_info['created_at']}
-⏰ Last Activity: {session_info['last_activity']}
+🕐 Created: {self.format_timestamp(session_info['created_at'])}
+⏰ Last Activity: {self.format_timestamp(session_info['last_activity'])}
 📊 Status: {'🟢 Active' if session_info['is_active'] else '🔴 Inactive'}
 
 👥 Participants:
-""" + "\n".join([f"• User {user_id}" for user_id in session_info['participants']])
-
+""" + "\n".join([f"• User {user_id} ({pseudonym})" for user_id, pseudonym in session_info['participants']])
+        
         keyboard = [
-            [InlineKeyboardButton("🔴 Close Session", callback_data=f"admin_session_close_{session_id}")],
+            [InlineKeyboardButton("🔴 Close Session", callback_data=ADMIN_CLOSE_SESSION.encode(session_id))],
             [InlineKeyboardButton("🔙 Back to Sessions", callback_data="admin_active_sessions")],
             [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")]
         ]
@@ -264,23 +442,16 @@ Choose an action:
         # Закрываем сессию
         self.db.close_session(session_id)
         
-        # Удаляем из памяти
-        if session_id in self.session_users:
-            for user_id in self.session_users[session_id]:
-                if user_id in self.user_sessions:
-                    del self.user_sessions[user_id]
-            del self.session_users[session_id]
-        
-        # Уведомляем участников
+        # Уведомляем участников (до удаления маршрутов из памяти)
         await self.notify_session_users(session_id, "🔴 This chat has been closed by administrator.")
         
-        keyboard = [
-            [InlineKeyboardButton("🔙 Back to Sessions", callback_data="admin_active_sessions")],
-            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Удаляем из памяти
+        self.routing.remove_session(session_id)
+        self.session_keys.discard(session_id)
         
-        await query.edit_message_text(f"✅ Session {session_id[:8]}... has been closed.", reply_markup=reply_markup)
+        await query.edit_message_text(
+            f"✅ Session {session_id[:8]}... has been closed.", reply_markup=ADMIN_SESSION_CLOSED_KEYBOARD
+        )
     
     async def ask_broadcast_message(self, query, context):
         """Запрос сообщения для рассылки"""
@@ -292,13 +463,10 @@ Choose an action:
         
         context.user_data['awaiting_broadcast'] = True
         
-        keyboard = [[InlineKeyboardButton("🔙 Cancel", callback_data="admin_panel")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await query.edit_message_text(
             "📢 Enter broadcast message:\n\n"
             "This message will be sent to all users who have active sessions.",
-            reply_markup=reply_markup
+            reply_markup=BROADCAST_CANCEL_KEYBOARD
         )
     
     async def handle_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -309,27 +477,19 @@ Choose an action:
             return
         
         message_text = update.message.text
-        sent_count = 0
-        failed_count = 0
+        context.user_data.pop('awaiting_broadcast', None)
+        # Рассылку нельзя повторять: апдейт (и сброшенный флаг) записываются до отправки
+        await self.persistence.commit_update(update.update_id, user_id, context.user_data)
         
         # Получаем всех уникальных пользователей с активными сессиями
-        all_users = set()
-        for session_users in self.session_users.values():
-            all_users.update(session_users)
-        
-        # Отправляем сообщение каждому пользователю
-        for user_id in all_users:
-            try:
-                await self.application.bot.send_message(
-                    user_id, 
-                    f"📢 Announcement from admin:\n\n{message_text}"
-                )
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Failed to send broadcast to {user_id}: {e}")
-                failed_count += 1
+        all_users = self.routing.all_members()
         
-        context.user_data['awaiting_broadcast'] = False
+        # Отправляем сообщение всем пользователям через общий пул
+        sent_count, failed_count = await self.outbound.send_many(
+            self.application.bot,
+            all_users,
+            f"📢 Announcement from admin:\n\n{message_text}"
+        )
         
         await update.message.reply_text(
             f"✅ Broadcast completed!\n"
@@ -348,71 +508,211 @@ Choose an action:
         
         # Выполняем очистку
         cleaned_count = self.db.cleanup_old_sessions()
+        # Перенос закрытых сессий в архив (запись на диск - вне цикла событий)
+        archived_count = await asyncio.to_thread(self.archiver.archive_inactive) if self.archiver else 0
         
         # Очищаем память
         active_session_ids = self.db.get_all_active_session_ids()
         active_sessions_set = set(active_session_ids)
         
         # Удаляем неактивные сессии из памяти
-        sessions_to_remove = []
-        for session_id in list(self.session_users.keys()):
-            if session_id not in active_sessions_set:
-                sessions_to_remove.append(session_id)
-        
-        for session_id in sessions_to_remove:
-            for user_id in self.session_users[session_id]:
-                if user_id in self.user_sessions and self.user_sessions[user_id] == session_id:
-                    del self.user_sessions[user_id]
-            del self.session_users[session_id]
-        
-        keyboard = [
-            [InlineKeyboardButton("🔄 Refresh Stats", callback_data="admin_stats")],
-            [InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        removed_count = self.routing.retain_sessions(active_sessions_set)
+        self.session_keys.retain_sessions(active_sessions_set)
         
         cleanup_info = f"""
 ✅ Cleanup completed!
 
-• Sessions removed from database: {len(sessions_to_remove)}
-• Sessions cleaned from memory: {len(sessions_to_remove)}
+• Sessions removed from database: {removed_count}
+• Sessions cleaned from memory: {removed_count}
+• Sessions moved to archive: {archived_count}
 • Remaining active sessions: {len(active_session_ids)}
 
 🕐 Cleanup time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
         """
         
-        await query.edit_message_text(cleanup_info.strip(), reply_markup=reply_markup)
+        await query.edit_message_text(cleanup_info.strip(), reply_markup=CLEANUP_DONE_KEYBOARD)
+    
+    async def admin_archive(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /archive <session_id> [ключ-фраза]: выгрузка архивной сессии
+
+        Тексты расшифровываются, только если указана ключ-фраза сессии.
+        """
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ Access denied.")
+            return
+        if not self.archiver:
+            await update.message.reply_text("❌ Archive is disabled (ARCHIVE_DIR is empty).")
+            return
+        if not context.args:
+            await update.message.reply_text("Usage: /archive <session_id> [passphrase]")
+            return
+        
+        session_id = context.args[0]
+        record = await asyncio.to_thread(self.archiver.read_session, session_id)
+        if record is None:
+            await update.message.reply_text(
+                f"❌ Session not found in archive (archive keeps sessions for {ARCHIVE_RETENTION_DAYS} days)."
+            )
+            return
+        
+        cipher = None
+        if len(context.args) > 1:
+            passphrase = context.args[1].lower()
+            cipher = await asyncio.to_thread(SessionCipher.from_passphrase, passphrase, session_id)
+            # Хеша ключ-фразы в архиве нет: ключ-фраза проверяется расшифровкой сообщения
+            if not self.archive_key_matches(record, cipher):
+                await update.message.reply_text("❌ Passphrase doesn't match this session.")
+                return
+        
+        export = {key: value for key, value in record.items() if key != 'messages'}
+        export['messages'] = [
+            self.export_archived_message(sender_type, timestamp, pseudonym, value, cipher)
+            for sender_type, timestamp, pseudonym, value in record['messages']
+        ]
+        document = io.BytesIO(json.dumps(export, ensure_ascii=False, indent=2).encode('utf-8'))
+        
+        await update.message.reply_text(self.format_archive_record(record))
+        await update.message.reply_document(document, filename=f"session-{session_id}.json")
+    
+    async def admin_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /search <слова>: сообщения сессий в рабочей БД, содержащие все слова"""
+        user_id = update.effective_user.id
+        
+        if not self.is_admin(user_id):
+            await update.message.reply_text("❌ Access denied.")
+            return
+        if self.db.search is None:
+            await update.message.reply_text("❌ Search is disabled (SEARCH_INDEX_KEY is empty).")
+            return
+        
+        tokens = self.db.search.tokens(' '.join(context.args))
+        if not tokens:
+            await update.message.reply_text("Usage: /search <words>")
+            return
+        
+        # Для страниц хранятся только токены: слова запроса в БД не попадают
+        context.user_data['admin_search'] = tokens
+        text, reply_markup = self.search_results_screen(tokens)
+        await update.message.reply_text(text, reply_markup=reply_markup)
+    
+    async def show_admin_search_page(self, query, context, direction, message_id):
+        """Страница результатов поиска по курсору из кнопки Prev/Next"""
+        user_id = query.from_user.id
+        
+        if not self.is_admin(user_id):
+            await query.edit_message_text("❌ Access denied.")
+            return
+        
+        tokens = context.user_data.get('admin_search')
+        if not tokens:
+            await query.edit_message_text("❌ Search expired. Use /search <words> again.")
+            return
+        
+        text, reply_markup = self.search_results_screen(tokens, message_id, direction)
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    
+    def search_results_screen(self, tokens, key=None, direction='next'):
+        """Текст и клавиатура страницы результатов поиска"""
+        messages, has_more = self.db.search_messages(tokens, key, direction, ADMIN_SEARCH_PAGE_SIZE)
+        if not messages and key is not None:
+            # Страница опустела (сессии перенесены в архив) - начинаем сначала
+            key, direction = None, 'next'
+            messages, has_more = self.db.search_messages(tokens, limit=ADMIN_SEARCH_PAGE_SIZE)
+        
+        if not messages:
+            return "🔎 No messages found.", BACK_TO_ADMIN_PANEL_KEYBOARD
+        
+        keyboard = [
+            [InlineKeyboardButton(
+                f"💬 {session_id[:8]}... 🎭 {pseudonym} 🕐 {self.format_timestamp(timestamp)}",
+                callback_data=ADMIN_VIEW_SESSION.encode(session_id)
+            )]
+            for message_id, session_id, pseudonym, timestamp in messages
+        ]
+        
+        has_prev = has_more if direction == 'prev' else key is not None
+        has_next = has_more if direction == 'next' else True
+        navigation = []
+        if has_prev:
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Prev", callback_data=ADMIN_SEARCH_PAGE.encode('prev', messages[0][0])
+            ))
+        if has_next:
+            navigation.append(InlineKeyboardButton(
+                "Next ➡️", callback_data=ADMIN_SEARCH_PAGE.encode('next', messages[-1][0])
+            ))
+        if navigation:
+            keyboard.append(navigation)
+        keyboard.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")])
+        
+        return (
+            "🔎 Search Results (newest first):\n\n"
+            "Format: SessionID Pseudonym Time\n"
+            "Click to view the session:",
+            InlineKeyboardMarkup(keyboard)
+        )
+    
+    def export_archived_message(self, sender_type, timestamp, pseudonym, value, cipher):
+        """Сообщение архивной сессии для выгрузки (текст или base64, если не расшифровано)"""
+        message = {'sender_type': sender_type, 'timestamp': timestamp, 'pseudonym': pseudonym}
+        try:
+            message['text'] = self.db.codec.decode(value, cipher)
+        except DecryptionError:
+            message['encrypted'] = base64.b64encode(value).decode('ascii')
+        return message
+    
+    def archive_key_matches(self, record, cipher):
+        """Расшифровывает ли cipher первое зашифрованное сообщение архивной сессии
+        (True, если зашифрованных сообщений нет)
+        """
+        for sender_type, timestamp, pseudonym, value in record['messages']:
+            if self.db.codec.is_encrypted(value):
+                try:
+                    self.db.codec.decode(value, cipher)
+                except DecryptionError:
+                    return False
+                return True
+        return True
+    
+    def format_archive_record(self, record):
+        """Краткое описание архивной сессии для админа"""
+        return (
+            f"🗄 Archived Session\n\n"
+            f"🆔 Session ID: {record['session_id']}\n"
+            f"👤 Creator: {record['creator_user_id']}\n"
+            f"👥 Participants: {len(record['participants'])}\n"
+            f"📝 Messages: {len(record['messages'])}\n"
+            f"🕐 Created: {self.format_timestamp(record['created_at'])}\n"
+            f"⏰ Last Activity: {self.format_timestamp(record['last_activity'])}\n"
+            f"📦 Archived: {self.format_timestamp(record['archived_at'])}"
+        )
     
     def get_session_details(self, session_id):
         """Получение деталей сессии"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT creator_user_id, created_at, last_activity, is_active
+            SELECT creator_user_id, created_at, last_activity, is_active, message_count
             FROM sessions WHERE session_id = ?
         ''', (session_id,))
         
         session_data = cursor.fetchone()
+        conn.close()
         if not session_data:
             return None
         
-        # Количество сообщений
-        cursor.execute('SELECT COUNT(*) FROM messages WHERE session_id = ?', (session_id,))
-        message_count_result = cursor.fetchone()
-        message_count = message_count_result[0] if message_count_result else 0
-        
-        conn.close()
-        
         return {
             'creator_id': session_data[0],
             'created_at': session_data[1],
             'last_activity': session_data[2],
             'is_active': bool(session_data[3]),
-            'message_count': message_count,
-            'participants': self.session_users.get(session_id, [])
+            'message_count': session_data[4],
+            'participants': self.db.get_session_participants(session_id)
         }
-
+    
     # Остальные методы остаются без изменений
     async def create_session(self, query, context):
         """Создание новой сессии"""
@@ -427,11 +727,17 @@ Choose an action:
             )
             return
         
-        session_id, passphrase = self.db.create_session(user_id)
+        # Хеш ключ-фразы выводится через scrypt - вне цикла событий. Апдейт отмечается
+        # обработанным вместе с сессией: повторная доставка не создаст вторую
+        session_id, passphrase, pseudonym = await asyncio.to_thread(
+            self.db.create_session, user_id, context.update_id
+        )
+        await self.unlock_session(session_id, passphrase)
+        if self.recorder:
+            self.recorder.session_created(user_id, session_id, passphrase)
         
         # Сохраняем сессию для пользователя
-        self.user_sessions[user_id] = session_id
-        self.session_users[session_id] = [user_id]
+        self.join_route(context, user_id, session_id, pseudonym)
         
         message_text = f"""
 ✅ Anonymous chat created!
@@ -439,34 +745,23 @@ Choose an action:
 🔑 Your passphrase:
 `{passphrase}`
 
-📋 Share this passphrase with your chat partner.
+📋 Share this passphrase with your chat partners (up to {MAX_SESSION_PARTICIPANTS} people).
+
+🎭 Your pseudonym in this chat: {pseudonym}
 
 ⚠️ Save the passphrase in a secure place - it cannot be recovered!
 
 💬 You can now send messages in this chat.
         """
         
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(message_text.strip(), reply_markup=reply_markup)
+        await query.edit_message_text(message_text.strip(), reply_markup=BACK_TO_MENU_KEYBOARD)
     
     async def ask_passphrase(self, query, context):
         """Запрос ключ-фразы для присоединения"""
         context.user_data['awaiting_passphrase'] = True
-        
-        message_text = """
-🔑 Enter passphrase to join the chat:
-
-Format: word-word-word-word-word-word
-
-Example: `amber-dolphin-galaxy-encryption-phoenix-avocado`
-        """
-        
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(message_text.strip(), reply_markup=reply_markup)
+        # Ключ-фраза для входа в новый чат, а не для разблокировки текущего
+        context.user_data.pop('unlock_session', None)
+        await query.edit_message_text(ASK_PASSPHRASE_TEXT, reply_markup=BACK_TO_MENU_KEYBOARD)
     
     async def handle_passphrase(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка введенной ключ-фразы"""
@@ -478,31 +773,33 @@ Example: `amber-dolphin-galaxy-encryption-phoenix-avocado`
         passphrase = update.message.text.strip().lower()
         
         # Проверка формата ключ-фразы
-        if len(passphrase.split('-')) != 6:
+        if len(passphrase.split('-')) != PASSPHRASE_WORDS:
             await update.message.reply_text(
                 "❌ Invalid passphrase format. "
                 "Use format: word-word-word-word-word-word"
             )
             return
         
-        session_id = self.db.join_session(passphrase, user_id)
+        try:
+            # Хеш ключ-фразы выводится через scrypt - вне цикла событий
+            joined = await asyncio.to_thread(self.db.join_session, passphrase, user_id)
+        except SessionFullError:
+            await update.message.reply_text(
+                f"❌ This chat is full (maximum {MAX_SESSION_PARTICIPANTS} participants)."
+            )
+            self.cancel_passphrase_prompt(context)
+            return
         
-        if session_id:
-            # Добавляем пользователя в сессию
-            self.user_sessions[user_id] = session_id
-            if session_id in self.session_users:
-                self.session_users[session_id].append(user_id)
-            else:
-                self.session_users[session_id] = [user_id]
+        if joined:
+            session_id, pseudonym, is_new = joined
+            cipher = await self.unlock_session(session_id, passphrase)
+            # Добавляем пользователя в сессию (повторный вход не дублирует доставку)
+            self.join_route(context, user_id, session_id, pseudonym)
             
             # Отправляем историю сообщений
-            messages = self.db.get_session_messages(session_id)
+            messages = self.db.get_session_messages(session_id, cipher=cipher)
             if messages:
-                history_text = "📜 Message history:\n\n"
-                for msg_text, sender_type, timestamp in messages:
-                    prefix = "👤 You: " if (sender_type == 'creator' and user_id != self.get_session_creator(session_id)) or \
-                                          (sender_type == 'responder' and user_id == self.get_session_creator(session_id)) else "🗣️ Anonymous: "
-                    history_text += f"{prefix}{msg_text}\n"
+                history_text = self.format_history(messages, pseudonym)
                 
                 # Разбиваем длинные сообщения
                 if len(history_text) > 4096:
@@ -514,18 +811,20 @@ Example: `amber-dolphin-galaxy-encryption-phoenix-avocado`
             
             await update.message.reply_text(
                 "✅ You've joined the anonymous chat! "
-                "You can now send messages."
+                "You can now send messages.\n\n"
+                f"🎭 Your pseudonym in this chat: {pseudonym}"
             )
             
-            # Уведомляем другого участника
-            await self.notify_session_users(session_id, "🔔 New participant joined the chat!", exclude_user=user_id)
+            # Уведомляем остальных участников
+            if is_new:
+                await self.notify_session_users(session_id, f"🔔 {pseudonym} joined the chat!", exclude_user=user_id)
         else:
             await update.message.reply_text(
                 "❌ Chat with this passphrase not found or was deleted. "
                 "Check the passphrase correctness."
             )
         
-        context.user_data['awaiting_passphrase'] = False
+        self.cancel_passphrase_prompt(context)
     
     async def show_my_sessions(self, query, context):
         """Показать активные сессии пользователя"""
@@ -543,7 +842,7 @@ Example: `amber-dolphin-galaxy-encryption-phoenix-avocado`
         for session_id in active_sessions[:10]:
             keyboard.append([InlineKeyboardButton(
                 f"💬 Chat {session_id[:8]}...", 
-                callback_data=f"session_{session_id}"
+                callback_data=ENTER_SESSION.encode(session_id)
             )])
         
         keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")])
@@ -558,85 +857,43 @@ Example: `amber-dolphin-galaxy-encryption-phoenix-avocado`
     async def enter_session(self, query, context, session_id):
         """Вход в существующую сессию"""
         user_id = query.from_user.id
-        self.user_sessions[user_id] = session_id
         
-        messages = self.db.get_session_messages(session_id)
+        # Войти можно только в сессию, участником которой пользователь уже является
+        pseudonym = self.db.get_participant(session_id, user_id)
+        if pseudonym is None:
+            await query.edit_message_text("❌ Chat not found.")
+            return
+        
+        self.join_route(context, user_id, session_id, pseudonym)
+        
+        cipher = self.session_keys.get(session_id)
+        if cipher is None:
+            await self.ask_unlock(query.edit_message_text, context, session_id)
+            return
+        
+        messages = self.db.get_session_messages(session_id, limit=20, cipher=cipher)
         
         if messages:
-            history_text = "📜 Message history:\n\n"
-            for msg_text, sender_type, timestamp in messages[-20:]:
-                prefix = "👤 You: " if (sender_type == 'creator' and user_id != self.get_session_creator(session_id)) or \
-                                      (sender_type == 'responder' and user_id == self.get_session_creator(session_id)) else "🗣️ Anonymous: "
-                history_text += f"{prefix}{msg_text}\n"
+            history_text = self.format_history(messages, pseudonym)
             
             await query.edit_message_text(
                 f"{history_text}\n💬 You can now send messages in this chat."
             )
         else:
             await query.edit_message_text(
-                "💬 Chat created. Waiting for messages from your partner.\n\n"
+                "💬 Chat created. Waiting for messages from other participants.\n\n"
                 "Send a message to start the conversation."
             )
     
     async def show_help(self, query, context):
         """Показать справку"""
-        help_text = """
-❓ Bot Usage Help
-
-📖 Basic commands:
-• /start - Main menu
-• /help - This help
-
-🔐 How anonymity works:
-• Bot doesn't store message logs
-• All messages are encrypted in the database
-• Sessions are automatically deleted after 24 hours
-• It's impossible to identify your partner
-
-🛡️ Security measures:
-• Use strong passphrases
-• Don't share passphrases with strangers
-• Sessions automatically close when inactive
-
-⚠️ Important:
-• Bot doesn't keep message history after session closure
-• Administrators don't have access to your message content
-• For maximum security use one-time passphrases
-
-🔑 Passphrase format:
-• 6 random English words
-• Format: word-word-word-word-word-word
-• Example: quantum-dragon-avocado-symphony-volcano-cyber
-        """
-        
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(help_text.strip(), reply_markup=reply_markup)
+        help_text = HELP_TEXT_SEARCH if self.db.search is not None else HELP_TEXT
+        await query.edit_message_text(help_text, reply_markup=BACK_TO_MENU_KEYBOARD)
     
     async def show_main_menu(self, query, context):
         """Показать главное меню"""
-        user_id = query.from_user.id
-        
-        keyboard = [
-            [InlineKeyboardButton("📝 Create Chat", callback_data="create_session")],
-            [InlineKeyboardButton("🔑 Join Chat", callback_data="join_session")],
-            [InlineKeyboardButton("📋 My Chats", callback_data="my_sessions")],
-            [InlineKeyboardButton("❓ Help", callback_data="help")]
-        ]
-        
-        if self.is_admin(user_id):
-            keyboard.append([InlineKeyboardButton("👑 Admin Panel", callback_data="admin_panel")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        welcome_text = """
-🤫 Welcome to the anonymous messaging bot!
-
-Choose an action:
-        """
-        
-        await query.edit_message_text(welcome_text.strip(), reply_markup=reply_markup)
+        self.cancel_passphrase_prompt(context)
+        await query.edit_message_text(MAIN_MENU_TEXT, reply_markup=self.main_menu_keyboard(query.from_user.id))
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка обычных сообщений"""
@@ -649,17 +906,22 @@ Choose an action:
             return
         
         if context.user_data.get('awaiting_passphrase'):
-            await self.handle_passphrase(update, context)
-            return
+            # Чат уже разблокирован (например, другим участником) - запрос ключ-фразы устарел
+            unlock_session = context.user_data.get('unlock_session')
+            if unlock_session and self.session_keys.get(unlock_session) is not None:
+                self.cancel_passphrase_prompt(context)
+            else:
+                await self.handle_passphrase(update, context)
+                return
         
-        if user_id not in self.user_sessions:
+        route = self.routing.current_route(user_id)
+        if route is None:
             await update.message.reply_text(
                 "❌ You are not in an active chat. "
                 "Use /start to create or join a chat."
             )
             return
-        
-        session_id = self.user_sessions[user_id]
+        session_id, pseudonym = route
         
         # Проверка длины сообщения
         if len(message_text) > MAX_MESSAGE_LENGTH:
@@ -669,38 +931,116 @@ Choose an action:
             )
             return
         
+        # Без ключа сессии сообщение не сохранить: нужна ключ-фраза
+        cipher = self.session_keys.get(session_id)
+        if cipher is None:
+            await self.ask_unlock(update.message.reply_text, context, session_id)
+            return
+        
         # Определяем тип отправителя
         creator_id = self.get_session_creator(session_id)
-        sender_type = 'creator' if user_id == creator_id else 'responder'
+        sender_type = SENDER_CREATOR if user_id == creator_id else SENDER_RESPONDER
         
-        # Сохраняем сообщение
-        self.db.add_message(session_id, sender_type, message_text)
+        # Сохраняем сообщение (зашифрованным) и отмечаем апдейт обработанным
+        self.db.add_message(session_id, sender_type, message_text, pseudonym, cipher, update.update_id)
         
         # Отправляем сообщение другим участникам
         await self.notify_session_users(
             session_id, 
-            f"🗣️ {message_text}", 
+            f"🗣️ {pseudonym}: {message_text}", 
             exclude_user=user_id
         )
         
         # Подтверждение отправки
         await update.message.reply_text("✅ Message sent")
     
+    def join_route(self, context, user_id, session_id, pseudonym):
+        """Текущая сессия пользователя: в памяти и в user_data (восстанавливается после перезапуска)"""
+        self.routing.join(user_id, session_id, pseudonym)
+        context.user_data['route'] = [session_id, pseudonym]
+        self.cancel_passphrase_prompt(context)
+    
+    async def warm_routes(self, user_data):
+        """Прогрев маршрутов при запуске: участники всех активных сессий одним запросом
+        и текущие сессии пользователей из сохраненного user_data
+
+        Запросы ключ-фразы от ask_unlock, сохраненные до перезапуска, удаляются из
+        user_data: по восстановленному маршруту ask_unlock спросит ключ-фразу при
+        следующем сообщении. Ожидание ключ-фразы для входа в чат сохраняется.
+
+        Возвращает (сессий, участников, восстановленных маршрутов).
+        """
+        memberships = self.db.get_active_participants()
+        self.routing.add_members(memberships)
+        memberships = set(memberships)
+        restored = 0
+        for user_id, data in user_data.items():
+            if 'unlock_session' in data or data.get('awaiting_passphrase', True) is False:
+                data.pop('awaiting_passphrase', None)
+                data.pop('unlock_session', None)
+                await self.persistence.update_user_data(user_id, data)
+            route = data.get('route')
+            if route and (route[0], user_id) in memberships:
+                self.routing.join(user_id, route[0], route[1])
+                restored += 1
+        return self.routing.session_count, len(memberships), restored
+    
+    async def unlock_session(self, session_id, passphrase):
+        """Ключ шифрования сессии по ключ-фразе (из кэша или выводится заново)
+
+        При выводе ключа шифруются сообщения сессии, сохраненные до шифрования.
+        """
+        cipher = self.session_keys.get(session_id)
+        if cipher is None:
+            # scrypt занимает десятки мс - вне цикла событий
+            cipher = await asyncio.to_thread(SessionCipher.from_passphrase, passphrase, session_id)
+            self.session_keys.put(session_id, cipher)
+            encrypted = await asyncio.to_thread(self.db.encrypt_legacy_messages, session_id, cipher)
+            if encrypted:
+                logger.info(f"Encrypted {encrypted} legacy messages of session {session_id[:8]}...")
+        return cipher
+    
+    async def ask_unlock(self, reply, context, session_id):
+        """Запрос ключ-фразы, когда ключа сессии нет в памяти (например, после перезапуска)"""
+        context.user_data['awaiting_passphrase'] = True
+        context.user_data['unlock_session'] = session_id
+        await reply(
+            "🔒 This chat is locked: messages are encrypted with a key derived from its passphrase, "
+            "and the bot doesn't keep it after a restart.\n\n"
+            "🔑 Enter the chat passphrase to unlock it:"
+        )
+    
+    def cancel_passphrase_prompt(self, context):
+        """Сброс ожидания ключ-фразы: ключи удаляются из user_data, а не сохраняются как False"""
+        context.user_data.pop('awaiting_passphrase', None)
+        context.user_data.pop('unlock_session', None)
+    
     async def notify_session_users(self, session_id, message, exclude_user=None):
-        """Уведомление всех пользователей сессии"""
-        if session_id not in self.session_users:
-            return
-        
-        for user_id in self.session_users[session_id]:
-            if user_id != exclude_user:
-                try:
-                    await self.application.bot.send_message(user_id, message)
-                except Exception as e:
-                    logger.error(f"Failed to send message to user {user_id}: {e}")
+        """Уведомление всех пользователей сессии (параллельно, через общий пул)"""
+        recipients = [user_id for user_id in self.routing.members(session_id) if user_id != exclude_user]
+        if recipients:
+            await self.outbound.send_many(self.application.bot, recipients, message)
+    
+    def format_history(self, messages, own_pseudonym):
+        """Форматирование истории сообщений для участника"""
+        history_text = "📜 Message history:\n\n"
+        for msg_text, sender_pseudonym, timestamp in messages:
+            if msg_text is None:
+                msg_text = "🔒 [message can't be decrypted]"
+            if sender_pseudonym == own_pseudonym:
+                prefix = "👤 You: "
+            else:
+                prefix = f"🗣️ {sender_pseudonym or 'Anonymous'}: "
+            history_text += f"{prefix}{msg_text}\n"
+        return history_text
+    
+    def format_timestamp(self, timestamp):
+        """Время из БД (секунды эпохи) в локальном формате"""
+        return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
     
     def get_session_creator(self, session_id):
         """Получение ID создателя сессии"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.connect()
         cursor = conn.cursor()
         
         cursor.execute(
@@ -714,23 +1054,92 @@ Choose an action:
         return result[0] if result else None
     
     def start_cleanup_thread(self):
-        """Запуск фонового потока для очистки"""
+        """Запуск фонового потока для очистки (останавливается через self.stopping)"""
         def cleanup_loop():
-            while True:
-                time.sleep(3600)
+            while not self.stopping.wait(3600):
                 self.db.cleanup_old_sessions()
-                logger.info("Performed cleanup of old sessions")
+                evicted = self.routing.evict_idle()
+                logger.info(f"Performed cleanup of old sessions, evicted {evicted} idle sessions from memory")
+                if self.archiver:
+                    try:
+                        archived = self.archiver.archive_inactive()
+                        self.archiver.enforce_retention()
+                        # Маршруты и ключи архивных сессий больше не нужны
+                        active_session_ids = set(self.db.get_all_active_session_ids())
+                        self.routing.retain_sessions(active_session_ids)
+                        self.session_keys.retain_sessions(active_session_ids)
+                        logger.info(f"Moved {archived} closed sessions to archive")
+                    except Exception as e:
+                        logger.error(f"Failed to archive closed sessions: {e}")
+        
+        self.stopping.clear()
+        self.cleanup_thread = threading.Thread(target=cleanup_loop, name=f'cleanup-{self.tenant.name}', daemon=True)
+        self.cleanup_thread.start()
+    
+    async def post_init(self, application):
+        """Прогрев маршрутов, запуск сброса состояния, очистки и общих ресурсов после инициализации приложения"""
+        start = time.perf_counter()
+        sessions, members, routes = await self.warm_routes(application.user_data)
+        logger.info(
+            f"Warmed routing for bot {self.tenant.name!r}: {sessions} sessions, {members} members, "
+            f"{routes} restored routes in {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
         
-        thread = threading.Thread(target=cleanup_loop, daemon=True)
-        thread.start()
+        self.persistence_task = asyncio.create_task(self.persistence.run_flusher())
+        self.start_cleanup_thread()
+        # Сторож цикла и сервер метрик - общие для ботов процесса
+        await self.host.start()
     
-    def run(self):
-        """Запуск бота"""
-        self.application = Application.builder().token(BOT_TOKEN).build()
+    async def post_shutdown(self, application):
+        """Остановка очистки, сброса состояния, записи апдейтов и общих ресурсов (после последнего бота)"""
+        self.stopping.set()
+        if self.cleanup_thread:
+            # Идущий перенос в архив завершается (транзакцией), новый не начнется
+            await asyncio.to_thread(self.cleanup_thread.join, SHUTDOWN_DRAIN_TIMEOUT)
+            if self.cleanup_thread.is_alive():
+                logger.warning(f"Cleanup of bot {self.tenant.name!r} is still running at exit")
+            self.cleanup_thread = None
+        if self.persistence_task:
+            # Последний сброс выполнит Application.shutdown() через persistence.flush()
+            self.persistence_task.cancel()
+        if self.recorder:
+            self.recorder.close()
+        await self.host.stop()
+    
+    def build_application(self, token=None, base_url=None):
+        """Создание приложения и регистрация обработчиков
+
+        token - по умолчанию токен бота из tenant. base_url позволяет направить
+        запросы к Bot API на другой сервер (например, на локальную замену из
+        loadtest/fake_api.py).
+        """
+        builder = (
+            Application.builder()
+            .token(token or self.tenant.token)
+            # Замер времени каждого вызова Bot API
+            .request(InstrumentedRequest(connection_pool_size=256))
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .persistence(self.persistence)
+            # update_id в контексте обработчиков кнопок
+            .context_types(ContextTypes(context=UpdateContext))
+        )
+        if base_url:
+            builder = builder.base_url(base_url)
+        self.application = builder.build()
+        
+        # Повторно доставленные апдейты отбрасываются до всех обработчиков (группа -2)
+        self.application.add_handler(TypeHandler(Update, self.persistence.skip_processed), group=-2)
+        
+        # Запись апдейтов до основных обработчиков (группа -1)
+        if self.recorder:
+            self.application.add_handler(TypeHandler(Update, self.recorder.record), group=-1)
         
         # Обработчики команд
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("help", self.show_help))
+        self.application.add_handler(CommandHandler("archive", self.admin_archive))
+        self.application.add_handler(CommandHandler("search", self.admin_search))
         
         # Обработчики кнопок
         self.application.add_handler(CallbackQueryHandler(self.button_handler))
@@ -740,14 +1149,19 @@ Choose an action:
             filters.TEXT & ~filters.COMMAND, self.handle_message
         ))
         
-        # Запуск фоновой очистки
-        self.start_cleanup_thread()
-        logger.info("Cleanup thread started")
-        
-        # Запуск бота
+        # Апдейт обработан - после всех обработчиков (группа 1)
+        self.application.add_handler(TypeHandler(Update, self.persistence.mark_processed), group=1)
+        return self.application
+    
+    def run(self):
+        """Запуск бота (вместе с остальными ботами его BotHost) до SIGINT/SIGTERM"""
         print("Bot is running...")
-        self.application.run_polling()
+        self.host.run()
 
 if __name__ == '__main__':
-    bot = AnonymousBot()
-    bot.run()
\ No newline at end of file
+    # Все боты из TENANTS (или один из BOT_TOKEN) - в одном процессе и цикле событий
+    host = BotHost()
+    for tenant in load_tenants():
+        AnonymousBot(tenant=tenant, host=host)
+    print(f"Running {len(host.bots)} bot(s)...")
+    host.run()
\ No newline at end of file
@@ -6,7 +6,77 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_IDS = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',') if id.strip()]
 
+# Несколько ботов в одном процессе: TENANTS=alpha,beta и для каждого бота
+# ALPHA_BOT_TOKEN, ALPHA_ADMIN_IDS (см. tenants.py). Без TENANTS - один бот из BOT_TOKEN
+TENANTS = [name.strip() for name in os.getenv('TENANTS', '').split(',') if name.strip()]
+
 # Настройки безопасности
 MAX_MESSAGE_LENGTH = 2000
 MAX_SESSIONS_PER_USER = 5
-SESSION_TIMEOUT_HOURS = 24
\ No newline at end of file
+SESSION_TIMEOUT_HOURS = 24
+
+# Словарь для ключ-фраз (например, diceware-список на 7776 слов).
+# Если не указан - используется встроенный словарь
+PASSPHRASE_WORDLIST = os.getenv('PASSPHRASE_WORDLIST')
+
+# Групповые чаты
+MAX_SESSION_PARTICIPANTS = 50
+# Сколько сообщений отправляется в Telegram одновременно при рассылке участникам
+OUTBOUND_CONCURRENCY = 25
+
+# Сжатие текста сообщений в БД: off, zlib или dict (zlib с предустановленным словарем)
+MESSAGE_COMPRESSION = os.getenv('MESSAGE_COMPRESSION', 'dict')
+
+# Секрет для поиска сессии по ключ-фразе (см. crypto.derive_passphrase_lookup). Хранится вне БД:
+# без него хеши ключ-фраз из копии БД не перебрать. После смены активные сессии не находятся по ключ-фразе
+PASSPHRASE_PEPPER = os.getenv('PASSPHRASE_PEPPER', '')
+
+# Сколько ключей шифрования сессий держать в памяти. Ключ выводится из ключ-фразы,
+# поэтому после вытеснения участнику придется ввести ключ-фразу заново
+SESSION_KEY_CACHE_SIZE = int(os.getenv('SESSION_KEY_CACHE_SIZE', '10000'))
+
+# Холодный архив закрытых сессий: каталог с сегментами (пустое значение отключает архив),
+# срок хранения архива, размер и возраст сегмента (дни), после которых начинается новый.
+# Сегмент удаляется целиком, поэтому файлы живут до ARCHIVE_RETENTION_DAYS + ARCHIVE_SEGMENT_DAYS дней
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', '90'))
+ARCHIVE_SEGMENT_MB = int(os.getenv('ARCHIVE_SEGMENT_MB', '64'))
+ARCHIVE_SEGMENT_DAYS = int(os.getenv('ARCHIVE_SEGMENT_DAYS', '1'))
+
+# Сколько последних update_id помнить, чтобы не обработать повторно доставленный апдейт,
+# и как часто сбрасывать на диск состояние диалогов и окно апдейтов (секунды)
+UPDATE_DEDUP_WINDOW = 10_000
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', '1.0'))
+
+# Сколько секунд при остановке ждать обработки принятых апдейтов, отправки сообщений
+# и записи в БД, прежде чем завершиться без них
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '10'))
+
+# Поиск по словам сообщений в админке (по умолчанию выключен): ключ токенов индекса (HMAC слов,
+# см. search.py) - отдельный длинный случайный секрет, не токен бота. Индекс раскрывает, в каких
+# сообщениях повторяются одни и те же слова, а с ключом - и сами слова. После смены ключа старые
+# сообщения не находятся поиском
+SEARCH_INDEX_KEY = os.getenv('SEARCH_INDEX_KEY', '')
+# Сколько результатов поиска показывать на одной странице
+ADMIN_SEARCH_PAGE_SIZE = 10
+
+# Сколько сессий показывать на одной странице списка в админке
+ADMIN_SESSIONS_PAGE_SIZE = 10
+
+# Метрики производительности в формате Prometheus (GET /metrics).
+# METRICS_PORT=0 отключает HTTP-сервер
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Профилировщик SQL-запросов: медленные запросы пишутся в лог вместе с планом
+QUERY_PROFILER = os.getenv('QUERY_PROFILER', '0') == '1'
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '50'))
+
+# Сторож цикла событий: частота замера задержки и порог,
+# при превышении которого в лог пишется стек заблокировавшего цикл кода
+LOOP_WATCHDOG_INTERVAL_MS = int(os.getenv('LOOP_WATCHDOG_INTERVAL_MS', '100'))
+LOOP_LAG_THRESHOLD_MS = int(os.getenv('LOOP_LAG_THRESHOLD_MS', '500'))
+
+# Запись входящих апдейтов (обезличенных) для воспроизведения в loadtest/replay.py.
+# Если не указан путь - запись отключена
+UPDATE_RECORD_PATH = os.getenv('UPDATE_RECORD_PATH')
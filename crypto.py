@@ -0,0 +1,121 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Параметры scrypt для ключа сессии: ~16 МБ памяти и десятки мс на вывод.
+# Менять нельзя: ими зашифрованы уже сохраненные сообщения
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+KEY_SIZE = 32
+NONCE_SIZE = 12
+# Соль значения для поиска сессии по ключ-фразе (отличается от соли ключа - идентификатора сессии)
+LOOKUP_SALT = b'anonymous-bot/passphrase-lookup/'
+
+
+class DecryptionError(Exception):
+    """Сообщение не расшифровывается этим ключом (чужая сессия или повреждение)"""
+
+
+def derive_session_key(passphrase, session_id):
+    """Ключ сессии из ключ-фразы (соль - идентификатор сессии)
+
+    Медленная операция (scrypt): в асинхронном коде вызывать через asyncio.to_thread.
+    """
+    return hashlib.scrypt(
+        passphrase.encode('utf-8'), salt=session_id.encode('ascii'),
+        n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=KEY_SIZE
+    )
+
+
+def derive_passphrase_lookup(passphrase, pepper=b''):
+    """Значение для поиска сессии по ключ-фразе (sessions.passphrase_hash)
+
+    Соль у всех сессий общая (иначе сессию не найти), поэтому вывод медленный
+    (scrypt, как у ключа сессии), а pepper - секрет вне БД (PASSPHRASE_PEPPER):
+    с ним перебор ключ-фраз по копии БД невозможен, без него - дорог.
+    В асинхронном коде вызывать через asyncio.to_thread.
+    """
+    return hashlib.scrypt(
+        passphrase.encode('utf-8'), salt=LOOKUP_SALT + pepper,
+        n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=KEY_SIZE
+    )
+
+
+class SessionCipher:
+    """AES-256-GCM с ключом одной сессии
+
+    Объект создается один раз на сессию: шифрование сообщения - одна
+    симметричная операция без повторного вывода ключа. Идентификатор
+    сессии входит в аутентифицированные данные, поэтому сообщение
+    нельзя незаметно перенести в другую сессию.
+    """
+    __slots__ = ('_aead', '_session_aad')
+    
+    def __init__(self, key, session_id):
+        self._aead = AESGCM(key)
+        self._session_aad = session_id.encode('ascii')
+    
+    @classmethod
+    def from_passphrase(cls, passphrase, session_id):
+        return cls(derive_session_key(passphrase, session_id), session_id)
+    
+    def encrypt(self, data, header=b''):
+        """nonce + шифротекст + тег; header (заголовок значения) тоже аутентифицируется"""
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + self._aead.encrypt(nonce, data, header + self._session_aad)
+    
+    def decrypt(self, data, header=b''):
+        try:
+            return self._aead.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], header + self._session_aad)
+        except InvalidTag:
+            raise DecryptionError("Message authentication failed") from None
+
+
+class SessionKeyCache:
+    """Ключи активных сессий в памяти (LRU с ограничением размера)
+
+    Ключ-фраза на диске не хранится, поэтому ключ появляется только при
+    создании сессии или вводе ключ-фразы. После перезапуска бота или
+    вытеснения из кэша участнику нужно ввести ключ-фразу заново.
+    """
+    
+    def __init__(self, max_size=10_000):
+        self.max_size = max_size
+        self._ciphers = OrderedDict()  # {session_id: SessionCipher}
+        self._lock = threading.Lock()
+    
+    def get(self, session_id):
+        """SessionCipher сессии или None, если ключа нет в памяти"""
+        with self._lock:
+            cipher = self._ciphers.get(session_id)
+            if cipher is not None:
+                self._ciphers.move_to_end(session_id)
+            return cipher
+    
+    def put(self, session_id, cipher):
+        with self._lock:
+            self._ciphers[session_id] = cipher
+            self._ciphers.move_to_end(session_id)
+            while len(self._ciphers) > self.max_size:
+                self._ciphers.popitem(last=False)
+    
+    def discard(self, session_id):
+        with self._lock:
+            self._ciphers.pop(session_id, None)
+    
+    def retain_sessions(self, active_session_ids):
+        """Удаление ключей всех сессий, кроме перечисленных"""
+        active_session_ids = set(active_session_ids)
+        with self._lock:
+            stale = [sid for sid in self._ciphers if sid not in active_session_ids]
+            for session_id in stale:
+                del self._ciphers[session_id]
+        return len(stale)
+    
+    def __len__(self):
+        return len(self._ciphers)
@@ -1,20 +1,164 @@
 import sqlite3
 import json
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 import secrets
 import hashlib
 
+from config import (
+    PASSPHRASE_WORDLIST, MAX_SESSION_PARTICIPANTS, QUERY_PROFILER, SLOW_QUERY_MS, MESSAGE_COMPRESSION,
+    SEARCH_INDEX_KEY, PASSPHRASE_PEPPER
+)
+from metrics import metrics
+from query_profiler import QueryProfiler, ProfiledConnection
+from crypto import DecryptionError, derive_passphrase_lookup
+from search import SearchTokenizer
+from storage import MessageCodec
+
+# Количество слов в ключ-фразе
+PASSPHRASE_WORDS = 6
+# Сколько раз пробуем вставить сессию при коллизии ключ-фраз
+MAX_PASSPHRASE_ATTEMPTS = 10
+# Префикс passphrase_hash, выведенного через crypto.derive_passphrase_lookup.
+# Значения без префикса - SHA-256 ключ-фразы (до шифрования сообщений), заменяются при входе
+PASSPHRASE_HASH_PREFIX = 's1:'
+# Текущая версия схемы БД (PRAGMA user_version)
+SCHEMA_VERSION = 6
+# Сколько сообщений переписывается за одну транзакцию при миграции на v3
+MIGRATION_BATCH_SIZE = 10_000
+# Тип отправителя сообщения (messages.sender_type)
+SENDER_CREATOR = 1
+SENDER_RESPONDER = 2
+# Текущее время в секундах эпохи (значение по умолчанию для колонок времени)
+_NOW_SQL = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+# Сортировки постраничного списка сессий: {название: колонка}
+SESSION_PAGE_ORDERS = {'activity': 'last_activity', 'messages': 'message_count'}
+
+# Слова для псевдонимов участников групповых чатов
+_PSEUDONYM_ADJECTIVES = (
+    'Silent', 'Hidden', 'Brave', 'Calm', 'Clever', 'Curious', 'Gentle', 'Lucky',
+    'Misty', 'Nimble', 'Quiet', 'Shy', 'Swift', 'Wise', 'Witty', 'Wild',
+)
+_PSEUDONYM_NOUNS = (
+    'Badger', 'Cheetah', 'Dolphin', 'Falcon', 'Fox', 'Heron', 'Koala', 'Lynx',
+    'Narwhal', 'Otter', 'Owl', 'Panda', 'Penguin', 'Raven', 'Tiger', 'Wolf',
+)
+
+# Встроенный словарь для ключ-фраз (без повторов)
+_DEFAULT_WORDS = [
+    # Colors
+    'amber', 'azure', 'bronze', 'crimson', 'emerald', 'golden', 'ivory', 'jade',
+    'lavender', 'magenta', 'obsidian', 'pearl', 'quartz', 'ruby', 'sapphire', 'topaz',
+
+    # Animals
+    'alligator', 'butterfly', 'cheetah', 'dolphin', 'elephant', 'flamingo', 'giraffe',
+    'hummingbird', 'iguana', 'jaguar', 'koala', 'leopard', 'mongoose', 'narwhal', 'octopus',
+    'penguin', 'quetzal', 'raccoon', 'salamander', 'tiger', 'unicorn', 'vulture', 'wolf',
+
+    # Nature
+    'asteroid', 'blizzard', 'cascade', 'diamond', 'echo', 'forest', 'galaxy', 'horizon',
+    'infinity', 'jungle', 'kingdom', 'lagoon', 'mountain', 'nebula', 'ocean', 'pyramid',
+    'quantum', 'river', 'sunset', 'tundra', 'universe', 'volcano', 'waterfall', 'zenith',
+
+    # Technology
+    'algorithm', 'blockchain', 'cyber', 'digital', 'encryption', 'firewall', 'graphics',
+    'hologram', 'internet', 'javascript', 'kernel', 'linux', 'matrix', 'network', 'opensource',
+    'python', 'robotics', 'server', 'terminal', 'ubuntu', 'virtual', 'wireless',
+
+    # Fantasy/Mythical
+    'arcanum', 'banshee', 'centaur', 'dragon', 'elf', 'phoenix', 'griffin', 'hydra',
+    'illusion', 'jinn', 'kraken', 'leviathan', 'mermaid', 'necromancer', 'oracle', 'pegasus',
+    'quest', 'rune', 'sorcerer', 'titan', 'valkyrie', 'wizard', 'yeti',
+
+    # Science
+    'atom', 'biology', 'chemistry', 'dimension', 'energy', 'fusion', 'gravity', 'hypothesis',
+    'isotope', 'joule', 'kinetic', 'laboratory', 'molecule', 'neutron', 'orbit', 'particle',
+    'research', 'spectrum', 'theory', 'ultraviolet', 'velocity', 'wavelength',
+
+    # Food
+    'avocado', 'blueberry', 'chocolate', 'dragonfruit', 'elderberry', 'fig', 'guava',
+    'honeydew', 'icecream', 'jackfruit', 'kiwi', 'lychee', 'mango', 'nectarine', 'olive',
+    'pomegranate', 'quince', 'raspberry', 'strawberry', 'tangerine', 'ugli', 'vanilla',
+
+    # Music
+    'acoustic', 'ballad', 'concert', 'electric', 'fugue', 'guitar', 'harmony',
+    'instrument', 'jazz', 'keyboard', 'lyrics', 'melody', 'note', 'opera', 'piano',
+    'quartet', 'rhythm', 'symphony', 'tempo', 'ukulele', 'violin', 'waltz',
+
+    # Travel
+    'adventure', 'backpack', 'cruise', 'destination', 'expedition', 'frontier', 'globe',
+    'island', 'journey', 'landmark', 'map', 'navigation', 'odyssey',
+    'passport', 'route', 'safari', 'tourism', 'voyage', 'wanderlust'
+]
+
+
+def load_wordlist(path=None):
+    """Загрузка словаря для ключ-фраз
+
+    Поддерживается простой список (одно слово в строке) и формат diceware
+    ("11111<TAB>abacus") - берется последнее поле строки. Без пути
+    возвращается встроенный словарь. Повторы удаляются.
+    """
+    if not path:
+        return tuple(dict.fromkeys(_DEFAULT_WORDS))
+    
+    with open(path, encoding='utf-8') as f:
+        # Дефис используется как разделитель слов в ключ-фразе
+        words = [line.split()[-1].lower() for line in f if line.strip()]
+    words = tuple(dict.fromkeys(word for word in words if '-' not in word))
+    
+    if len(words) < 2:
+        raise ValueError(f'Wordlist {path} is too small')
+    return words
+
+# Словарь загружается один раз при импорте модуля
+WORDS = load_wordlist(PASSPHRASE_WORDLIST)
+
+class SessionFullError(Exception):
+    """В сессии уже максимальное количество участников"""
+
+# Время и ошибки каждого публичного метода попадают в метрики bot_db_*
+@metrics.instrument('bot_db', 'method')
 class AnonymousDatabase:
-    def __init__(self, db_path='anonymous_messages.db'):
+    def __init__(self, db_path='anonymous_messages.db', words=WORDS, profiler=None, codec=None,
+                 search_key=SEARCH_INDEX_KEY, passphrase_pepper=PASSPHRASE_PEPPER):
         self.db_path = db_path
+        self.words = words
+        # Секрет для поиска сессий по ключ-фразе (в БД не хранится)
+        self.passphrase_pepper = passphrase_pepper.encode('utf-8')
+        # Сжатие текста сообщений (MESSAGE_COMPRESSION: off, zlib, dict)
+        self.codec = codec or MessageCodec(MESSAGE_COMPRESSION)
+        # Поисковый индекс сообщений (с пустым ключом не ведется)
+        self.search = SearchTokenizer(search_key) if search_key else None
+        # Профилировщик запросов включается через QUERY_PROFILER=1
+        if profiler is None and QUERY_PROFILER:
+            profiler = QueryProfiler(SLOW_QUERY_MS)
+        self.profiler = profiler
         self.init_database()
     
+    def connect(self):
+        """Открытие соединения с БД (профилируемого, если профилировщик включен)"""
+        if self.profiler is None:
+            return sqlite3.connect(self.db_path)
+        
+        conn = sqlite3.connect(self.db_path, factory=ProfiledConnection)
+        conn.profiler = self.profiler
+        return conn
+    
     def init_database(self):
-        """Инициализация базы данных"""
-        conn = sqlite3.connect(self.db_path)
+        """Инициализация базы данных
+
+        Схема актуальной версии не проверяется заново: при обычном запуске
+        это одно чтение PRAGMA user_version без DDL.
+        """
+        conn = self.connect()
         cursor = conn.cursor()
         
+        if cursor.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+            conn.close()
+            return
+        
         # Таблица сессий
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS sessions (
@@ -39,178 +183,498 @@ class AnonymousDatabase:
             )
         ''')
         
+        # Ключ-фраза уникальна среди активных сессий
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_active_passphrase
+            ON sessions (passphrase_hash) WHERE is_active = TRUE
+        ''')
+        
+        self._migrate(cursor)
+        
         conn.commit()
         conn.close()
     
-    def generate_passphrase(self):
-        """Генерация уникальной ключ-фразы на английском"""
-        words = [
-            # Colors
-            'amber', 'azure', 'bronze', 'crimson', 'emerald', 'golden', 'ivory', 'jade', 
-            'lavender', 'magenta', 'obsidian', 'pearl', 'quartz', 'ruby', 'sapphire', 'topaz',
-            
-            # Animals
-            'alligator', 'butterfly', 'cheetah', 'dolphin', 'elephant', 'flamingo', 'giraffe', 
-            'hummingbird', 'iguana', 'jaguar', 'koala', 'leopard', 'mongoose', 'narwhal', 'octopus',
-            'penguin', 'quetzal', 'raccoon', 'salamander', 'tiger', 'unicorn', 'vulture', 'wolf',
-            
-            # Nature
-            'asteroid', 'blizzard', 'cascade', 'diamond', 'echo', 'forest', 'galaxy', 'horizon',
-            'infinity', 'jungle', 'kingdom', 'lagoon', 'mountain', 'nebula', 'ocean', 'pyramid',
-            'quantum', 'river', 'sunset', 'tundra', 'universe', 'volcano', 'waterfall', 'zenith',
-            
-            # Technology
-            'algorithm', 'blockchain', 'cyber', 'digital', 'encryption', 'firewall', 'graphics',
-            'hologram', 'internet', 'javascript', 'kernel', 'linux', 'matrix', 'network', 'opensource',
-            'python', 'quantum', 'robotics', 'server', 'terminal', 'ubuntu', 'virtual', 'wireless',
-            
-            # Fantasy/Mythical
-            'arcanum', 'banshee', 'centaur', 'dragon', 'elf', 'phoenix', 'griffin', 'hydra',
-            'illusion', 'jinn', 'kraken', 'leviathan', 'mermaid', 'necromancer', 'oracle', 'pegasus',
-            'quest', 'rune', 'sorcerer', 'titan', 'unicorn', 'valkyrie', 'wizard', 'yeti',
-            
-            # Science
-            'atom', 'biology', 'chemistry', 'dimension', 'energy', 'fusion', 'gravity', 'hypothesis',
-            'isotope', 'joule', 'kinetic', 'laboratory', 'molecule', 'neutron', 'orbit', 'particle',
-            'quantum', 'research', 'spectrum', 'theory', 'ultraviolet', 'velocity', 'wavelength',
-            
-            # Food
-            'avocado', 'blueberry', 'chocolate', 'dragonfruit', 'elderberry', 'fig', 'guava',
-            'honeydew', 'icecream', 'jackfruit', 'kiwi', 'lychee', 'mango', 'nectarine', 'olive',
-            'pomegranate', 'quince', 'raspberry', 'strawberry', 'tangerine', 'ugli', 'vanilla',
-            
-            # Music
-            'acoustic', 'ballad', 'concert', 'digital', 'electric', 'fugue', 'guitar', 'harmony',
-            'instrument', 'jazz', 'keyboard', 'lyrics', 'melody', 'note', 'opera', 'piano',
-            'quartet', 'rhythm', 'symphony', 'tempo', 'ukulele', 'violin', 'waltz',
-            
-            # Travel
-            'adventure', 'backpack', 'cruise', 'destination', 'expedition', 'frontier', 'globe',
-            'horizon', 'island', 'journey', 'kingdom', 'landmark', 'map', 'navigation', 'odyssey',
-            'passport', 'quest', 'route', 'safari', 'tourism', 'voyage', 'wanderlust'
-        ]
+    def _migrate(self, cursor):
+        """Пошаговое обновление схемы до SCHEMA_VERSION"""
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        for next_version in range(version + 1, SCHEMA_VERSION + 1):
+            getattr(self, f'_migrate_v{next_version}')(cursor)
+            cursor.execute(f'PRAGMA user_version = {next_version}')
+    
+    def _migrate_v1(self, cursor):
+        """Участники сессий с псевдонимами (групповые чаты)"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS participants (
+                session_id TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                pseudonym TEXT NOT NULL,
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (session_id, user_id),
+                UNIQUE (session_id, pseudonym),
+                FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_participants_user ON participants (user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id)')
+        cursor.execute('ALTER TABLE messages ADD COLUMN sender_pseudonym TEXT')
+        
+        # Старые сессии: создатель становится участником, отправители - псевдонимами
+        cursor.execute('''
+            INSERT OR IGNORE INTO participants (session_id, user_id, pseudonym)
+            SELECT session_id, creator_user_id, 'Creator' FROM sessions
+            WHERE creator_user_id IS NOT NULL
+        ''')
+        cursor.execute('''
+            UPDATE messages SET sender_pseudonym =
+                CASE sender_type WHEN 'creator' THEN 'Creator' ELSE 'Anonymous' END
+        ''')
+    
+    def _migrate_v2(self, cursor):
+        """Счетчик сообщений в сессии и индексы для постраничного списка в админке"""
+        cursor.execute('ALTER TABLE sessions ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0')
+        cursor.execute('''
+            UPDATE sessions SET message_count =
+                (SELECT COUNT(*) FROM messages m WHERE m.session_id = sessions.session_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sessions_active_activity
+            ON sessions (last_activity) WHERE is_active = TRUE
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sessions_active_messages
+            ON sessions (message_count) WHERE is_active = TRUE
+        ''')
+    
+    def _migrate_v3(self, cursor):
+        """Компактное хранение: время в секундах эпохи, тип отправителя числом, сжатый текст
+
+        SQLite не меняет типы колонок, поэтому таблицы пересоздаются. Сообщения
+        переносятся пакетами по MIGRATION_BATCH_SIZE с фиксацией после каждого:
+        прерванная миграция продолжается с последнего перенесенного сообщения.
+        """
+        conn = cursor.connection
+        
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS messages_v3 (
+                message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                sender_type INTEGER NOT NULL, -- SENDER_CREATOR или SENDER_RESPONDER
+                message_text BLOB NOT NULL, -- TEXT или сжатый BLOB (storage.MessageCodec)
+                timestamp INTEGER NOT NULL DEFAULT ({_NOW_SQL}),
+                sender_pseudonym TEXT,
+                FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+            )
+        ''')
+        conn.commit()
         
+        last_id = cursor.execute('SELECT COALESCE(MAX(message_id), 0) FROM messages_v3').fetchone()[0]
         while True:
-            # Генерируем фразу из 6 слов для большей безопасности
-            passphrase = '-'.join(secrets.choice(words) for _ in range(6))
-            passphrase_hash = self._hash_passphrase(passphrase)
-            
-            if not self._passphrase_exists(passphrase_hash):
-                return passphrase
+            rows = cursor.execute('''
+                SELECT message_id, session_id, sender_type, message_text,
+                       CAST(strftime('%s', timestamp) AS INTEGER), sender_pseudonym
+                FROM messages WHERE message_id > ?
+                ORDER BY message_id LIMIT ?
+            ''', (last_id, MIGRATION_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            cursor.executemany('''
+                INSERT INTO messages_v3
+                    (message_id, session_id, sender_type, message_text, timestamp, sender_pseudonym)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [
+                (
+                    message_id, session_id,
+                    SENDER_CREATOR if sender_type == 'creator' else SENDER_RESPONDER,
+                    self.codec.encode(message_text), timestamp or 0, pseudonym
+                )
+                for message_id, session_id, sender_type, message_text, timestamp, pseudonym in rows
+            ])
+            conn.commit()
+            last_id = rows[-1][0]
+        
+        # Замена таблиц и новая версия схемы фиксируются одной транзакцией
+        cursor.execute('BEGIN')
+        cursor.execute('DROP TABLE messages')
+        cursor.execute('ALTER TABLE messages_v3 RENAME TO messages')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id)')
+        
+        # Сессии и участники заметно меньше сообщений - переносятся одним запросом
+        cursor.execute(f'''
+            CREATE TABLE sessions_v3 (
+                session_id TEXT PRIMARY KEY,
+                passphrase_hash TEXT NOT NULL,
+                creator_user_id INTEGER,
+                created_at INTEGER NOT NULL DEFAULT ({_NOW_SQL}),
+                last_activity INTEGER NOT NULL DEFAULT ({_NOW_SQL}),
+                is_active BOOLEAN DEFAULT TRUE,
+                message_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO sessions_v3 (rowid, session_id, passphrase_hash, creator_user_id,
+                                     created_at, last_activity, is_active, message_count)
+            SELECT rowid, session_id, passphrase_hash, creator_user_id,
+                   COALESCE(CAST(strftime('%s', created_at) AS INTEGER), 0),
+                   COALESCE(CAST(strftime('%s', last_activity) AS INTEGER), 0),
+                   is_active, message_count
+            FROM sessions
+        ''')
+        cursor.execute('DROP TABLE sessions')
+        cursor.execute('ALTER TABLE sessions_v3 RENAME TO sessions')
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_active_passphrase
+            ON sessions (passphrase_hash) WHERE is_active = TRUE
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sessions_active_activity
+            ON sessions (last_activity) WHERE is_active = TRUE
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sessions_active_messages
+            ON sessions (message_count) WHERE is_active = TRUE
+        ''')
+        
+        cursor.execute(f'''
+            CREATE TABLE participants_v3 (
+                session_id TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                pseudonym TEXT NOT NULL,
+                joined_at INTEGER NOT NULL DEFAULT ({_NOW_SQL}),
+                PRIMARY KEY (session_id, user_id),
+                UNIQUE (session_id, pseudonym),
+                FOREIGN KEY (session_id) REFERENCES sessions (session_id)
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO participants_v3 (session_id, user_id, pseudonym, joined_at)
+            SELECT session_id, user_id, pseudonym, COALESCE(CAST(strftime('%s', joined_at) AS INTEGER), 0)
+            FROM participants
+        ''')
+        cursor.execute('DROP TABLE participants')
+        cursor.execute('ALTER TABLE participants_v3 RENAME TO participants')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_participants_user ON participants (user_id)')
+    
+    def _migrate_v4(self, cursor):
+        """Индекс холодного архива: где лежит запись каждой архивной сессии (см. archive.py)"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archive_index (
+                session_id TEXT PRIMARY KEY,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                message_count INTEGER NOT NULL,
+                created_at INTEGER,
+                last_activity INTEGER,
+                archived_at INTEGER NOT NULL
+            )
+        ''')
+        # Удаление сегментов по сроку хранения
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_archive_segment ON archive_index (segment, archived_at)
+        ''')
+    
+    def _migrate_v5(self, cursor):
+        """Окно обработанных апдейтов и состояние диалогов пользователей (см. persistence.py)"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS processed_updates (
+                update_id INTEGER PRIMARY KEY
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_state (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            )
+        ''')
+    
+    def _migrate_v6(self, cursor):
+        """Полнотекстовый индекс сообщений для поиска в админке (см. search.py)
+
+        rowid - message_id. Строки индекса удаляются триггером вместе с
+        сообщениями (перенос в архив), поэтому индекс покрывает только
+        сессии в рабочей БД. Уже сохраненные сообщения не индексируются:
+        их тексты зашифрованы.
+        """
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(tokens, detail=none)
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_search_delete AFTER DELETE ON messages BEGIN
+                DELETE FROM message_search WHERE rowid = old.message_id;
+            END
+        ''')
+    
+    def generate_passphrase(self):
+        """Генерация ключ-фразы на английском (без обращения к БД)"""
+        # Генерируем фразу из 6 слов для большей безопасности
+        return '-'.join(secrets.choice(self.words) for _ in range(PASSPHRASE_WORDS))
     
     def _hash_passphrase(self, passphrase):
-        """Хеширование ключ-фразы"""
+        """Хеширование ключ-фразы (scrypt: десятки мс, в асинхронном коде - через asyncio.to_thread)"""
+        return PASSPHRASE_HASH_PREFIX + derive_passphrase_lookup(passphrase, self.passphrase_pepper).hex()
+    
+    def _legacy_hash_passphrase(self, passphrase):
+        """Прежний хеш ключ-фразы (SHA-256 без соли) - для сессий, созданных до его замены"""
         return hashlib.sha256(passphrase.encode()).hexdigest()
     
-    def _passphrase_exists(self, passphrase_hash):
-        """Проверка существования ключ-фразы"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+    def _add_participant(self, cursor, session_id, user_id):
+        """Добавление участника со свободным псевдонимом
+
+        Возвращает (псевдоним, добавлен_ли_участник_сейчас).
+        """
         cursor.execute(
-            'SELECT 1 FROM sessions WHERE passphrase_hash = ? AND is_active = TRUE',
-            (passphrase_hash,)
+            'SELECT pseudonym FROM participants WHERE session_id = ? AND user_id = ?',
+            (session_id, user_id)
         )
+        row = cursor.fetchone()
+        if row:
+            return row[0], False
         
-        exists = cursor.fetchone() is not None
-        conn.close()
-        return exists
+        cursor.execute('SELECT COUNT(*) FROM participants WHERE session_id = ?', (session_id,))
+        if cursor.fetchone()[0] >= MAX_SESSION_PARTICIPANTS:
+            raise SessionFullError(session_id)
+        
+        attempt = 0
+        while True:
+            pseudonym = f'{secrets.choice(_PSEUDONYM_ADJECTIVES)} {secrets.choice(_PSEUDONYM_NOUNS)}'
+            # После нескольких коллизий добавляем номер
+            if attempt >= 5:
+                pseudonym = f'{pseudonym} {attempt}'
+            try:
+                cursor.execute('''
+                    INSERT INTO participants (session_id, user_id, pseudonym)
+                    VALUES (?, ?, ?)
+                ''', (session_id, user_id, pseudonym))
+                return pseudonym, True
+            except sqlite3.IntegrityError:
+                attempt += 1
     
-    def create_session(self, creator_user_id):
-        """Создание новой сессии"""
+    def create_session(self, creator_user_id, update_id=None):
+        """Создание новой сессии. Возвращает (session_id, passphrase, pseudonym)
+
+        Уникальность ключ-фразы среди активных сессий обеспечивает уникальный
+        индекс: при коллизии пробуем другую фразу в той же транзакции.
+        update_id - апдейт отмечается обработанным в той же транзакции.
+        """
         session_id = secrets.token_hex(16)
-        passphrase = self.generate_passphrase()
-        passphrase_hash = self._hash_passphrase(passphrase)
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO sessions (session_id, passphrase_hash, creator_user_id)
-            VALUES (?, ?, ?)
-        ''', (session_id, passphrase_hash, creator_user_id))
+        for _ in range(MAX_PASSPHRASE_ATTEMPTS):
+            passphrase = self.generate_passphrase()
+            try:
+                cursor.execute('''
+                    INSERT INTO sessions (session_id, passphrase_hash, creator_user_id)
+                    VALUES (?, ?, ?)
+                ''', (session_id, self._hash_passphrase(passphrase), creator_user_id))
+                break
+            except sqlite3.IntegrityError:
+                continue
+        else:
+            conn.close()
+            raise RuntimeError('Failed to generate a unique passphrase')
+        
+        pseudonym, _ = self._add_participant(cursor, session_id, creator_user_id)
+        
+        if update_id is not None:
+            cursor.execute('INSERT OR IGNORE INTO processed_updates (update_id) VALUES (?)', (update_id,))
         
         conn.commit()
         conn.close()
         
-        return session_id, passphrase
+        return session_id, passphrase, pseudonym
     
     def join_session(self, passphrase, responder_user_id):
-        """Присоединение к сессии по ключ-фразе"""
+        """Присоединение к сессии по ключ-фразе
+
+        Возвращает (session_id, псевдоним, новый_ли_участник) или None.
+        Хеш ключ-фразы прежнего формата заменяется при первом входе.
+        """
         passphrase_hash = self._hash_passphrase(passphrase)
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT session_id FROM sessions 
-            WHERE passphrase_hash = ? AND is_active = TRUE
-        ''', (passphrase_hash,))
+            SELECT session_id, passphrase_hash FROM sessions 
+            WHERE passphrase_hash IN (?, ?) AND is_active = TRUE
+        ''', (passphrase_hash, self._legacy_hash_passphrase(passphrase)))
         
         result = cursor.fetchone()
         
         if result:
             session_id = result[0]
+            if result[1] != passphrase_hash:
+                cursor.execute(
+                    'UPDATE sessions SET passphrase_hash = ? WHERE session_id = ?', (passphrase_hash, session_id)
+                )
+            try:
+                pseudonym, is_new = self._add_participant(cursor, session_id, responder_user_id)
+            except SessionFullError:
+                conn.close()
+                raise
             # Обновляем время последней активности
             cursor.execute('''
-                UPDATE sessions SET last_activity = CURRENT_TIMESTAMP 
+                UPDATE sessions SET last_activity = ? 
                 WHERE session_id = ?
-            ''', (session_id,))
+            ''', (int(time.time()), session_id))
             conn.commit()
             conn.close()
-            return session_id
+            return session_id, pseudonym, is_new
         
         conn.close()
         return None
     
-    def add_message(self, session_id, sender_type, message_text):
-        """Добавление сообщения в сессию"""
-        conn = sqlite3.connect(self.db_path)
+    def get_participant(self, session_id, user_id):
+        """Псевдоним участника сессии (None, если пользователь не участник)"""
+        conn = self.connect()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO messages (session_id, sender_type, message_text)
-            VALUES (?, ?, ?)
-        ''', (session_id, sender_type, message_text))
+        cursor.execute(
+            'SELECT pseudonym FROM participants WHERE session_id = ? AND user_id = ?',
+            (session_id, user_id)
+        )
+        
+        result = cursor.fetchone()
+        conn.close()
+        return result[0] if result else None
+    
+    def get_session_participants(self, session_id):
+        """Участники сессии: [(user_id, pseudonym), ...]"""
+        conn = self.connect()
+        cursor = conn.cursor()
         
-        # Обновляем время последней активности сессии
         cursor.execute('''
-            UPDATE sessions SET last_activity = CURRENT_TIMESTAMP 
+            SELECT user_id, pseudonym FROM participants
             WHERE session_id = ?
+            ORDER BY joined_at ASC
         ''', (session_id,))
         
-        conn.commit()
+        participants = cursor.fetchall()
         conn.close()
+        return participants
     
-    def get_session_messages(self, session_id):
-        """Получение всех сообщений сессии"""
-        conn = sqlite3.connect(self.db_path)
+    def add_message(self, session_id, sender_type, message_text, sender_pseudonym=None, cipher=None, update_id=None):
+        """Добавление сообщения в сессию (sender_type - SENDER_CREATOR или SENDER_RESPONDER)
+
+        cipher - crypto.SessionCipher сессии: текст сохраняется зашифрованным.
+        update_id - апдейт с сообщением отмечается обработанным в той же транзакции.
+        """
+        now = int(time.time())
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT message_text, sender_type, timestamp 
-            FROM messages 
-            WHERE session_id = ? 
-            ORDER BY timestamp ASC
-        ''', (session_id,))
+            INSERT INTO messages (session_id, sender_type, message_text, timestamp, sender_pseudonym)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (session_id, sender_type, self.codec.encode(message_text, cipher), now, sender_pseudonym))
+        
+        if self.search is not None:
+            document = self.search.document(message_text)
+            if document:
+                cursor.execute(
+                    'INSERT INTO message_search (rowid, tokens) VALUES (?, ?)', (cursor.lastrowid, document)
+                )
+        
+        # Обновляем время последней активности и счетчик сообщений сессии
+        cursor.execute('''
+            UPDATE sessions SET last_activity = ?, message_count = message_count + 1
+            WHERE session_id = ?
+        ''', (now, session_id))
+        
+        if update_id is not None:
+            cursor.execute('INSERT OR IGNORE INTO processed_updates (update_id) VALUES (?)', (update_id,))
+        
+        conn.commit()
+        conn.close()
+    
+    def encrypt_legacy_messages(self, session_id, cipher, batch_size=1000):
+        """Шифрование сообщений сессии, сохраненных до шифрования (TEXT или BLOB без FLAG_ENCRYPTED)
+
+        Ключа сессии при миграции нет, поэтому такие сообщения шифруются при
+        первой разблокировке сессии - пакетами по batch_size с фиксацией после
+        каждого. Возвращает количество зашифрованных сообщений.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        total, last_id = 0, 0
+        while True:
+            # substr от BLOB - BLOB: первый байт (формат) меньше FLAG_ENCRYPTED
+            cursor.execute('''
+                SELECT message_id, message_text FROM messages
+                WHERE session_id = ? AND message_id > ?
+                  AND (typeof(message_text) = 'text' OR substr(message_text, 1, 1) < x'80')
+                ORDER BY message_id
+                LIMIT ?
+            ''', (session_id, last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany('UPDATE messages SET message_text = ? WHERE message_id = ?', [
+                (self.codec.encode(self.codec.decode(text), cipher), message_id)
+                for message_id, text in rows
+            ])
+            conn.commit()
+            total += len(rows)
+            last_id = rows[-1][0]
+        
+        conn.close()
+        return total
+    
+    def get_session_messages(self, session_id, limit=None, cipher=None):
+        """Получение сообщений сессии: [(text, sender_pseudonym, timestamp), ...]
+
+        limit - только последние limit сообщений (распаковываются только они).
+        timestamp - секунды эпохи. cipher - crypto.SessionCipher сессии: одним
+        объектом расшифровывается вся страница. text = None, если сообщение
+        не расшифровывается (нет ключа или данные повреждены).
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        if limit is None:
+            cursor.execute('''
+                SELECT message_text, sender_pseudonym, timestamp 
+                FROM messages 
+                WHERE session_id = ? 
+                ORDER BY message_id ASC
+            ''', (session_id,))
+            rows = cursor.fetchall()
+        else:
+            cursor.execute('''
+                SELECT message_text, sender_pseudonym, timestamp
+                FROM messages
+                WHERE session_id = ?
+                ORDER BY message_id DESC
+                LIMIT ?
+            ''', (session_id, limit))
+            rows = cursor.fetchall()[::-1]
         
-        messages = cursor.fetchall()
         conn.close()
+        
+        decode = self.codec.decode
+        messages = []
+        for text, pseudonym, timestamp in rows:
+            try:
+                text = decode(text, cipher)
+            except DecryptionError:
+                text = None
+            messages.append((text, pseudonym, timestamp))
         return messages
     
     def get_user_active_sessions(self, user_id):
         """Получение активных сессий пользователя"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT session_id FROM sessions 
-            WHERE (creator_user_id = ? OR session_id IN (
-                SELECT DISTINCT m.session_id FROM messages m
-                JOIN sessions s ON m.session_id = s.session_id
-                WHERE s.creator_user_id != ? AND s.is_active = TRUE
-            )) AND is_active = TRUE
-        ''', (user_id, user_id))
+            SELECT s.session_id FROM participants p
+            JOIN sessions s ON s.session_id = p.session_id
+            WHERE p.user_id = ? AND s.is_active = TRUE
+            ORDER BY s.last_activity DESC
+        ''', (user_id,))
         
         sessions = [row[0] for row in cursor.fetchall()]
         conn.close()
@@ -218,10 +682,10 @@ class AnonymousDatabase:
     
     def cleanup_old_sessions(self):
         """Очистка старых сессий"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
-        cutoff_time = datetime.now() - timedelta(hours=24)
+        cutoff_time = int(time.time()) - 24 * 3600
         
         cursor.execute('''
             UPDATE sessions SET is_active = FALSE 
@@ -233,7 +697,7 @@ class AnonymousDatabase:
     
     def close_session(self, session_id):
         """Закрытие сессии"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -246,7 +710,7 @@ class AnonymousDatabase:
     # Новые методы для статистики
     def get_system_stats(self):
         """Получение статистики системы"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         # Общее количество активных сессий
@@ -258,19 +722,19 @@ class AnonymousDatabase:
         total_messages = cursor.fetchone()[0] or 0
         
         # Старые сессии (24+ часов)
-        cutoff_time = (datetime.now() - timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')
+        cutoff_time = int(time.time()) - 24 * 3600
         cursor.execute('SELECT COUNT(*) FROM sessions WHERE last_activity < ? AND is_active = TRUE', (cutoff_time,))
         old_sessions_result = cursor.fetchone()
         old_sessions = old_sessions_result[0] if old_sessions_result else 0
         
         # Сессии созданные сегодня
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('SELECT COUNT(*) FROM sessions WHERE DATE(created_at) = ?', (today,))
+        today = int(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+        cursor.execute('SELECT COUNT(*) FROM sessions WHERE created_at >= ?', (today,))
         sessions_today_result = cursor.fetchone()
         sessions_today = sessions_today_result[0] if sessions_today_result else 0
         
         # Сообщения сегодня
-        cursor.execute('SELECT COUNT(*) FROM messages WHERE DATE(timestamp) = ?', (today,))
+        cursor.execute('SELECT COUNT(*) FROM messages WHERE timestamp >= ?', (today,))
         messages_today_result = cursor.fetchone()
         messages_today = messages_today_result[0] if messages_today_result else 0
         
@@ -296,29 +760,115 @@ class AnonymousDatabase:
     
     def get_all_active_sessions_with_stats(self):
         """Получение всех активных сессий со статистикой"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT s.session_id, 
-                   s.creator_user_id,
-                   s.created_at,
-                   s.last_activity,
-                   COUNT(m.message_id) as message_count
-            FROM sessions s
-            LEFT JOIN messages m ON s.session_id = m.session_id
-            WHERE s.is_active = TRUE
-            GROUP BY s.session_id
-            ORDER BY s.last_activity DESC
+            SELECT session_id, creator_user_id, created_at, last_activity, message_count
+            FROM sessions
+            WHERE is_active = TRUE
+            ORDER BY last_activity DESC
         ''')
         
         sessions = cursor.fetchall()
         conn.close()
         return sessions
     
+    def get_active_sessions_page(self, order='activity', key=None, direction='next', limit=10):
+        """Страница активных сессий (keyset-пагинация, по убыванию order)
+
+        order - 'activity' (last_activity) или 'messages' (message_count).
+        key - (значение, rowid) крайней строки уже показанной страницы,
+        direction - 'next' (дальше по списку) или 'prev' (назад).
+
+        Возвращает (rows, has_more): rows - [(rowid, session_id, creator_user_id,
+        created_at, last_activity, message_count), ...] в порядке показа,
+        has_more - есть ли еще строки в направлении direction.
+        """
+        column = SESSION_PAGE_ORDERS[order]
+        forward = direction == 'next'
+        conditions = ['is_active = TRUE']
+        params = []
+        if key is not None:
+            conditions.append(f'({column}, rowid) {"<" if forward else ">"} (?, ?)')
+            params.extend(key)
+        sort = 'DESC' if forward else 'ASC'
+        
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
+            SELECT rowid, session_id, creator_user_id, created_at, last_activity, message_count
+            FROM sessions
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {column} {sort}, rowid {sort}
+            LIMIT ?
+        ''', (*params, limit + 1))
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not forward:
+            rows.reverse()
+        return rows, has_more
+    
+    def search_messages(self, tokens, key=None, direction='next', limit=10):
+        """Страница сообщений со всеми токенами tokens (SearchTokenizer.tokens), новые первыми
+
+        key - message_id крайнего сообщения уже показанной страницы,
+        direction - 'next' (более старые) или 'prev' (более новые).
+
+        Возвращает (rows, has_more): rows - [(message_id, session_id,
+        sender_pseudonym, timestamp), ...] в порядке показа.
+        """
+        forward = direction == 'next'
+        conditions = ['message_search MATCH ?']
+        params = [SearchTokenizer.match(tokens)]
+        if key is not None:
+            conditions.append(f'message_search.rowid {"<" if forward else ">"} ?')
+            params.append(key)
+        sort = 'DESC' if forward else 'ASC'
+        
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
+            SELECT m.message_id, m.session_id, m.sender_pseudonym, m.timestamp
+            FROM message_search
+            JOIN messages m ON m.message_id = message_search.rowid
+            WHERE {' AND '.join(conditions)}
+            ORDER BY message_search.rowid {sort}
+            LIMIT ?
+        ''', (*params, limit + 1))
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not forward:
+            rows.reverse()
+        return rows, has_more
+    
+    def get_active_participants(self):
+        """Участники всех активных сессий: [(session_id, user_id), ...] (прогрев маршрутов при запуске)"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT p.session_id, p.user_id FROM participants p
+            JOIN sessions s ON s.session_id = p.session_id
+            WHERE s.is_active = TRUE
+        ''')
+        participants = cursor.fetchall()
+        conn.close()
+        return participants
+    
     def get_all_active_session_ids(self):
         """Получение ID всех активных сессий"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
         
         cursor.execute('SELECT session_id FROM sessions WHERE is_active = TRUE')
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import signal
+import time
+
+from config import (
+    OUTBOUND_CONCURRENCY, METRICS_HOST, METRICS_PORT, LOOP_WATCHDOG_INTERVAL_MS, LOOP_LAG_THRESHOLD_MS,
+    SHUTDOWN_DRAIN_TIMEOUT
+)
+from metrics import metrics, start_http_server
+from outbound import OutboundDispatcher
+from watchdog import LoopWatchdog
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать текущий апдейт после того, как очередь отброшена по истечении SHUTDOWN_DRAIN_TIMEOUT
+DRAIN_GRACE = 1.0
+
+
+def _drop_queued_updates(update_queue):
+    """Отбрасывание необработанных апдейтов из очереди Application, кроме
+    последнего элемента - сигнала остановки, который кладет Application.stop()
+
+    Возвращает количество отброшенных апдейтов. Апдейты, уже подтвержденные
+    Telegram, теряются; неподтвержденные придут повторно после перезапуска.
+    """
+    items = []
+    while not update_queue.empty():
+        items.append(update_queue.get_nowait())
+        update_queue.task_done()
+    if items:
+        update_queue.put_nowait(items[-1])
+    return max(len(items) - 1, 0)
+
+
+class BotHost:
+    """Общие ресурсы ботов одного процесса и запуск нескольких ботов в одном цикле событий
+
+    Каждый бот (AnonymousBot) обслуживает свой токен со своими БД, сессиями и
+    администраторами. Общие для всех: пул исходящих сообщений (лимит
+    параллельных запросов к Bot API на процесс), сторож цикла событий и
+    HTTP-сервер метрик. Датчики /metrics - суммы по всем ботам.
+
+    Время запуска и остановки каждого бота пишется в лог и в метрику
+    bot_lifecycle_seconds{phase=startup|drain|shutdown}.
+    """
+    
+    def __init__(self):
+        self.created_at = time.perf_counter()
+        self.bots = []
+        # Ограниченный пул параллельной отправки сообщений
+        self.outbound = OutboundDispatcher(OUTBOUND_CONCURRENCY)
+        # Сторож цикла событий: замер задержки и поиск блокирующих вызовов
+        self.watchdog = LoopWatchdog(
+            interval=LOOP_WATCHDOG_INTERVAL_MS / 1000,
+            threshold=LOOP_LAG_THRESHOLD_MS / 1000
+        )
+        self.metrics_server = None
+        self._users = 0  # Запущенные боты (общие ресурсы работают, пока есть хоть один)
+        
+        # Датчики очередей и памяти для /metrics и экрана Performance
+        metrics.gauge('bot_outbound_in_flight', lambda: self.outbound.in_flight)
+        metrics.gauge('bot_outbound_pending', lambda: self.outbound.pending)
+        metrics.gauge('bot_routing_users', lambda: sum(bot.routing.user_count for bot in self.bots))
+        metrics.gauge('bot_routing_sessions', lambda: sum(bot.routing.session_count for bot in self.bots))
+        metrics.gauge('bot_session_keys', lambda: sum(len(bot.session_keys) for bot in self.bots))
+        metrics.gauge(
+            'bot_duplicate_updates_skipped', lambda: sum(bot.persistence.duplicates for bot in self.bots)
+        )
+        metrics.gauge('bot_update_queue_size', lambda: sum(
+            bot.application.update_queue.qsize() for bot in self.bots if bot.application
+        ))
+    
+    def add(self, bot):
+        self.bots.append(bot)
+    
+    async def start(self):
+        """Запуск сторожа цикла и сервера метрик (при старте первого бота)"""
+        self._users += 1
+        if self._users > 1:
+            return
+        
+        self.watchdog.start()
+        if METRICS_PORT:
+            try:
+                self.metrics_server = await start_http_server(metrics, METRICS_HOST, METRICS_PORT)
+                logger.info(f"Metrics available at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+            except OSError as e:
+                logger.error(f"Failed to start metrics server: {e}")
+    
+    async def stop(self):
+        """Остановка сервера метрик и сторожа цикла (после остановки последнего бота)"""
+        self._users -= 1
+        if self._users > 0:
+            return
+        
+        if self.metrics_server:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+            self.metrics_server = None
+        await self.watchdog.stop()
+    
+    def run(self):
+        """Запуск всех ботов до SIGINT/SIGTERM"""
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+    
+    async def _serve(self):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows: остановка по KeyboardInterrupt
+                pass
+        
+        started = []
+        try:
+            for bot in self.bots:
+                start = time.perf_counter()
+                application = bot.build_application()
+                # Тот же порядок запуска, что и в Application.run_polling
+                await application.initialize()
+                await bot.post_init(application)
+                started.append(bot)
+                await application.updater.start_polling()
+                await application.start()
+                self._report(bot, 'startup', time.perf_counter() - start)
+            logger.info(
+                f"Started {len(started)} bot(s) in {time.perf_counter() - self.created_at:.2f} s since launch"
+            )
+            await stop.wait()
+        finally:
+            await self._shutdown(started)
+    
+    async def _shutdown(self, bots):
+        """Остановка ботов: новые апдейты не принимаются, принятые обрабатываются
+        (вместе с отправкой ответов) не дольше SHUTDOWN_DRAIN_TIMEOUT секунд
+        """
+        start = time.perf_counter()
+        deadline = start + SHUTDOWN_DRAIN_TIMEOUT
+        await asyncio.gather(*(self._stop_bot(bot, deadline) for bot in bots))
+        logger.info(f"Stopped {len(bots)} bot(s) in {time.perf_counter() - start:.2f} s")
+    
+    async def _stop_bot(self, bot, deadline):
+        application = bot.application
+        start = time.perf_counter()
+        try:
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                # stop() ждет обработки всех принятых апдейтов, в т.ч. их исходящих сообщений
+                stopping = asyncio.ensure_future(application.stop())
+                done, _ = await asyncio.wait({stopping}, timeout=max(deadline - time.perf_counter(), 0))
+                if not done:
+                    dropped = _drop_queued_updates(application.update_queue)
+                    logger.warning(
+                        f"Bot {bot.tenant.name!r} not drained in {SHUTDOWN_DRAIN_TIMEOUT:g} s: "
+                        f"dropped {dropped} queued updates, waiting for the current one"
+                    )
+                    done, _ = await asyncio.wait({stopping}, timeout=DRAIN_GRACE)
+                if done:
+                    stopping.result()
+                else:
+                    # Обработчик завершится с ошибкой после закрытия соединений в shutdown()
+                    logger.warning(f"Bot {bot.tenant.name!r}: abandoning the update being processed")
+            drained = time.perf_counter()
+            self._report(bot, 'drain', drained - start)
+            
+            # Сброс отложенных записей (состояние диалогов, окно апдейтов)
+            await application.shutdown()
+        except Exception as e:
+            logger.error(f"Failed to stop bot {bot.tenant.name!r}: {e}")
+            drained = time.perf_counter()
+        finally:
+            await bot.post_shutdown(application)
+        self._report(bot, 'shutdown', time.perf_counter() - drained)
+    
+    def _report(self, bot, phase, seconds):
+        metrics.observe('bot_lifecycle_seconds', seconds, phase=phase, tenant=bot.tenant.name)
+        logger.info(f"Bot {bot.tenant.name!r} {phase} took {seconds * 1000:.0f} ms")
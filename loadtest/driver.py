@@ -0,0 +1,263 @@
+"""Нагрузочный тест бота целиком: настоящий Application против FakeBotAPI
+
+Примеры:
+    python loadtest/driver.py --pairs 1000 --messages 10
+    python loadtest/driver.py --pairs 200 --latency 20-80 --rate-limit 0.02 --output run.json
+
+Каждая пара пользователей создает чат, второй участник присоединяется по
+ключ-фразе, после чего они обмениваются сообщениями. Задержка доставки
+измеряется от постановки апдейта в очередь getUpdates до получения
+пересланного сообщения собеседником.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# HTTP-сервер метрик, запись апдейтов и архив в тесте не нужны
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ['UPDATE_RECORD_PATH'] = ''
+os.environ['ARCHIVE_DIR'] = ''
+
+from bot import AnonymousBot  # noqa: E402
+from database import AnonymousDatabase  # noqa: E402
+from metrics import metrics  # noqa: E402
+from loadtest.fake_api import FakeBotAPI  # noqa: E402
+
+TOKEN = '123456:LOADTEST'
+# Пользователи пары: FIRST_USER_ID + 2 * pair и FIRST_USER_ID + 2 * pair + 1
+FIRST_USER_ID = 10_000_000
+
+
+class Stats:
+    """Результаты прогона"""
+    
+    def __init__(self):
+        self.setup_latencies = []  # Создание чата + присоединение, секунды
+        self.relay_latencies = []  # Доставка одного сообщения, секунды
+        self.pairs_ok = 0
+        self.pairs_failed = 0
+        self.lost_messages = 0
+        self.errors = {}
+    
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+async def run_pair(api, pair, args, stats, rng):
+    """Сценарий одной пары: создание, присоединение, переписка"""
+    creator = FIRST_USER_ID + 2 * pair
+    partner = creator + 1
+    timeout = args.timeout
+    
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    start = time.perf_counter()
+    try:
+        api.push_callback(TOKEN, creator, 'create_session')
+        _, match = await api.wait_for(TOKEN, creator, r'`([a-z0-9-]+)`', timeout)
+        passphrase = match.group(1)
+        
+        api.push_callback(TOKEN, partner, 'join_session')
+        await api.wait_for(TOKEN, partner, 'Enter passphrase', timeout)
+        api.push_message(TOKEN, partner, passphrase)
+        await api.wait_for(TOKEN, partner, "You've joined", timeout)
+    except asyncio.TimeoutError as e:
+        stats.pairs_failed += 1
+        stats.error('setup_timeout')
+        logging.getLogger(__name__).debug(f'Pair {pair} setup failed: {e}')
+        return
+    stats.setup_latencies.append(time.perf_counter() - start)
+    
+    for i in range(args.messages):
+        sender, receiver = (creator, partner) if i % 2 == 0 else (partner, creator)
+        marker = f'lt-{pair}-{i}'
+        sent_at = time.perf_counter()
+        api.push_message(TOKEN, sender, f'{marker} {"x" * args.message_size}')
+        try:
+            received_at, _ = await api.wait_for(TOKEN, receiver, re.escape(marker) + r'\b', timeout)
+        except asyncio.TimeoutError:
+            stats.lost_messages += 1
+            stats.error('relay_timeout')
+            continue
+        stats.relay_latencies.append(received_at - sent_at)
+        if args.think_time:
+            await asyncio.sleep(rng.uniform(0, args.think_time))
+    stats.pairs_ok += 1
+
+
+def latency_stats(samples):
+    """Сводка задержек в миллисекундах"""
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+    
+    def pick(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+async def start_bot(api, db_path, token=TOKEN):
+    """Запуск бота против FakeBotAPI в текущем цикле событий"""
+    bot = AnonymousBot(db=AnonymousDatabase(db_path))
+    application = bot.build_application(token=token, base_url=api.base_url)
+    
+    # Тот же порядок запуска, что и в run_polling
+    await application.initialize()
+    await bot.post_init(application)
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+    return bot
+
+
+async def stop_bot(bot):
+    application = bot.application
+    if application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await bot.post_shutdown(application)
+    await application.shutdown()
+
+
+def metrics_summary(name):
+    return {
+        label: {'count': count, 'errors': errors, 'p50_ms': p50 * 1000, 'p95_ms': p95 * 1000, 'p99_ms': p99 * 1000}
+        for label, count, errors, p50, p95, p99 in metrics.summary(name)
+    }
+
+
+async def run(args):
+    low, high = args.latency
+    api = await FakeBotAPI(
+        latency=(low / 1000, high / 1000),
+        rate_limit_ratio=args.rate_limit,
+        retry_after=args.retry_after,
+        failure_ratio=args.failure_rate,
+        fault_methods=args.fault_methods,
+        seed=args.seed,
+    ).start()
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            bot = await start_bot(api, os.path.join(tmp, 'loadtest.db'))
+            try:
+                stats = Stats()
+                rng = random.Random(args.seed)
+                print(f'Running {args.pairs} pairs x {args.messages} messages...', file=sys.stderr)
+                start = time.perf_counter()
+                await asyncio.gather(*(run_pair(api, pair, args, stats, rng) for pair in range(args.pairs)))
+                elapsed = time.perf_counter() - start
+                
+                lag_p50, lag_p95, lag_p99 = bot.watchdog.lag_summary()
+            finally:
+                # Без остановки бота опрос обновлений не завершится и asyncio.run зависнет
+                await stop_bot(bot)
+    finally:
+        await api.stop()
+    
+    return {
+        'meta': {
+            'pairs': args.pairs,
+            'messages_per_pair': args.messages,
+            'latency_ms': list(args.latency),
+            'rate_limit': args.rate_limit,
+            'failure_rate': args.failure_rate,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'elapsed_s': elapsed,
+        'pairs_ok': stats.pairs_ok,
+        'pairs_failed': stats.pairs_failed,
+        'messages_relayed': len(stats.relay_latencies),
+        'messages_lost': stats.lost_messages,
+        'throughput_msg_per_s': len(stats.relay_latencies) / elapsed if elapsed else 0.0,
+        'setup': latency_stats(stats.setup_latencies),
+        'relay': latency_stats(stats.relay_latencies),
+        'errors': stats.errors,
+        'loop_lag_ms': {'p50': lag_p50 * 1000, 'p95': lag_p95 * 1000, 'p99': lag_p99 * 1000},
+        'fake_api': {'requests': dict(api.request_counts), 'injected': dict(api.injected)},
+        'handlers': metrics_summary('bot_handler'),
+        'database': metrics_summary('bot_db'),
+        'telegram': metrics_summary('bot_telegram'),
+    }
+
+
+def print_report(report):
+    relay = report['relay']
+    print(f"\nPairs: {report['pairs_ok']} ok, {report['pairs_failed']} failed "
+          f"in {report['elapsed_s']:.1f}s")
+    print(f"Messages: {report['messages_relayed']} relayed, {report['messages_lost']} lost, "
+          f"{report['throughput_msg_per_s']:.1f} msg/s")
+    if relay['count']:
+        print(f"Relay latency: p50 {relay['p50_ms']:.1f}ms, p95 {relay['p95_ms']:.1f}ms, "
+              f"p99 {relay['p99_ms']:.1f}ms, max {relay['max_ms']:.1f}ms")
+    lag = report['loop_lag_ms']
+    print(f"Loop lag: p50 {lag['p50']:.1f}ms, p95 {lag['p95']:.1f}ms, p99 {lag['p99']:.1f}ms")
+    if report['errors']:
+        print(f"Errors: {report['errors']}")
+    print(f"Injected faults: {report['fake_api']['injected'] or 'none'}")
+    
+    print(f'\n{"handler":32} {"count":>8} {"p50":>9} {"p95":>9} {"p99":>9}')
+    for label, row in list(report['handlers'].items())[:8]:
+        print(f"{label:32} {row['count']:8} {row['p50_ms']:7.1f}ms {row['p95_ms']:7.1f}ms {row['p99_ms']:7.1f}ms")
+
+
+def parse_range(value):
+    low, _, high = value.partition('-')
+    return float(low), float(high or low)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load test against a fake Bot API')
+    parser.add_argument('--pairs', type=int, default=100, help='concurrent user pairs')
+    parser.add_argument('--messages', type=int, default=10, help='messages per pair')
+    parser.add_argument('--message-size', type=int, default=40, help='padding characters per message')
+    parser.add_argument('--ramp', type=float, default=1.0, help='spread pair start over N seconds')
+    parser.add_argument('--think-time', type=float, default=0.0, help='max pause between messages, seconds')
+    parser.add_argument('--timeout', type=float, default=30.0, help='wait for a reply, seconds')
+    parser.add_argument('--latency', type=parse_range, default=(0.0, 0.0),
+                        help='Bot API latency in ms, e.g. 20-80')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after for injected 429s')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of requests answered with 500')
+    parser.add_argument('--fault-methods', nargs='+', default=['sendMessage'],
+                        help='Bot API methods that receive injected 429/500 responses')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write JSON report to this file')
+    args = parser.parse_args()
+    
+    # Лог каждого HTTP-запроса заглушил бы отчет
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logging.getLogger('bot').setLevel(logging.WARNING)
+    
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""Локальная замена Telegram Bot API для нагрузочного тестирования
+
+Поддерживает методы, которыми пользуется бот (getMe, getUpdates,
+setWebhook/deleteWebhook, sendMessage, copyMessage, editMessageText,
+answerCallbackQuery), с настраиваемыми задержкой, ответами 429 с
+retry_after и ошибками. Входящие апдейты добавляются методами
+push_message/push_callback, а исходящие сообщения бота можно дождаться
+через wait_for.
+"""
+import asyncio
+import email.parser
+import email.policy
+import http
+import itertools
+import json
+import random
+import re
+import time
+from collections import defaultdict, deque
+from urllib.parse import parse_qsl
+
+# Методы, к которым применяются задержка и ошибки
+SEND_METHODS = {'sendMessage', 'copyMessage', 'editMessageText', 'answerCallbackQuery'}
+# Параметры, которые PTB передает как есть (не в JSON)
+_RAW_PARAMS = {'text', 'caption', 'callback_query_id', 'inline_message_id'}
+
+
+class _BotState:
+    """Очередь апдейтов одного токена"""
+    
+    def __init__(self, bot_id):
+        self.bot_id = bot_id
+        self.update_ids = itertools.count(1)
+        self.updates = deque()
+        self.has_updates = asyncio.Event()
+        self.webhook_url = ''
+
+
+class _Inbox:
+    """Сообщения бота в одном чате, еще не разобранные wait_for"""
+    
+    def __init__(self, limit=None):
+        self.messages = deque(maxlen=limit)  # [(time.perf_counter(), text)]
+        self.changed = asyncio.Event()
+
+
+class FakeBotAPI:
+    """HTTP-сервер, имитирующий Telegram Bot API"""
+    
+    def __init__(self, latency=(0.0, 0.0), rate_limit_ratio=0.0, retry_after=1,
+                 failure_ratio=0.0, fault_methods=SEND_METHODS, inbox_limit=None, seed=None):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.failure_ratio = failure_ratio
+        self.fault_methods = set(fault_methods)
+        self.random = random.Random(seed)
+        self.port = None
+        self.request_counts = defaultdict(int)
+        self.injected = defaultdict(int)
+        self._server = None
+        self._connections = set()
+        self._bots = {}  # {token: _BotState}
+        self._message_ids = itertools.count(1000)
+        self._callback_ids = itertools.count(1)
+        # inbox_limit ограничивает память, если сообщения бота почти никто не ждет
+        self._inboxes = defaultdict(lambda: _Inbox(inbox_limit))  # {(token, chat_id): _Inbox}
+    
+    @property
+    def base_url(self):
+        """base_url для Application.builder()"""
+        return f'http://127.0.0.1:{self.port}/bot'
+    
+    async def start(self, host='127.0.0.1', port=0):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+    
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        # Незавершенные long-polling запросы getUpdates
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+    
+    def _bot(self, token):
+        state = self._bots.get(token)
+        if state is None:
+            bot_id = int(token.split(':', 1)[0]) if token.split(':', 1)[0].isdigit() else 1
+            state = self._bots[token] = _BotState(bot_id)
+        return state
+    
+    # Входящие апдейты
+    
+    def push_update(self, token, update):
+        """Добавление произвольного апдейта (update_id назначается заново)"""
+        state = self._bot(token)
+        update = dict(update, update_id=next(state.update_ids))
+        state.updates.append(update)
+        state.has_updates.set()
+        return update['update_id']
+    
+    def push_message(self, token, user_id, text):
+        """Текстовое сообщение от пользователя в личный чат с ботом"""
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'text': text,
+        }
+        command = re.match(r'/\w+', text)
+        if command:
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': command.end()}]
+        return self.push_update(token, {'message': message})
+    
+    def push_callback(self, token, user_id, data, message_id=None):
+        """Нажатие inline-кнопки пользователем"""
+        return self.push_update(token, {'callback_query': {
+            'id': str(next(self._callback_ids)),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+                'text': 'menu',
+            },
+        }})
+    
+    def pending_updates(self, token):
+        """Апдейты, получение которых бот еще не подтвердил (offset)"""
+        return len(self._bot(token).updates)
+    
+    # Исходящие сообщения бота
+    
+    async def wait_for(self, token, chat_id, pattern, timeout=30.0):
+        """Ожидание сообщения бота в чате chat_id, содержащего pattern (regex)
+
+        Возвращает (время получения по time.perf_counter(), match). Сообщения,
+        пришедшие до совпадения, отбрасываются.
+        """
+        inbox = self._inboxes[(token, chat_id)]
+        regex = re.compile(pattern)
+        deadline = time.perf_counter() + timeout
+        while True:
+            while inbox.messages:
+                received_at, text = inbox.messages.popleft()
+                match = regex.search(text)
+                if match:
+                    return received_at, match
+            
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f'No message matching {pattern!r} in chat {chat_id}')
+            inbox.changed.clear()
+            try:
+                await asyncio.wait_for(inbox.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    
+    def _deliver(self, token, chat_id, text):
+        inbox = self._inboxes[(token, chat_id)]
+        inbox.messages.append((time.perf_counter(), text))
+        inbox.changed.set()
+    
+    # HTTP
+    
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, target, _ = request_line.decode('latin-1').split(' ', 2)
+                
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                
+                payload = await self._dispatch(target, headers.get('content-type', ''), body)
+                data = json.dumps(payload).encode()
+                status = http.HTTPStatus(payload.get('error_code', 200))
+                writer.write(
+                    f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                    'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(data)}\r\n'
+                    'Connection: keep-alive\r\n\r\n'.encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Остановка сервера; отмену не пробрасываем, иначе asyncio пишет ее в лог
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+    
+    async def _dispatch(self, target, content_type, body):
+        match = re.match(r'/bot([^/]+)/(\w+)', target)
+        if not match:
+            return {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        token, method = match.groups()
+        params = _parse_params(content_type, body)
+        self.request_counts[method] += 1
+        
+        if method in SEND_METHODS:
+            low, high = self.latency
+            if high > 0:
+                await asyncio.sleep(self.random.uniform(low, high))
+        if method in self.fault_methods:
+            roll = self.random.random()
+            if roll < self.rate_limit_ratio:
+                self.injected['429'] += 1
+                return {
+                    'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after},
+                }
+            if roll < self.rate_limit_ratio + self.failure_ratio:
+                self.injected['500'] += 1
+                return {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+        
+        handler = getattr(self, f'_api_{method}', None)
+        result = await handler(token, params) if handler else True
+        return {'ok': True, 'result': result}
+    
+    # Методы Bot API
+    
+    async def _api_getMe(self, token, params):
+        state = self._bot(token)
+        return {
+            'id': state.bot_id, 'is_bot': True, 'first_name': 'FakeBot',
+            'username': f'fake_bot_{state.bot_id}', 'can_join_groups': False,
+            'can_read_all_group_messages': False, 'supports_inline_queries': False,
+        }
+    
+    async def _api_getUpdates(self, token, params):
+        state = self._bot(token)
+        offset = params.get('offset') or 0
+        limit = params.get('limit') or 100
+        timeout = params.get('timeout') or 0
+        
+        while state.updates and state.updates[0]['update_id'] < offset:
+            state.updates.popleft()
+        if not state.updates and timeout:
+            state.has_updates.clear()
+            try:
+                await asyncio.wait_for(state.has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(state.updates, limit))
+    
+    async def _api_setWebhook(self, token, params):
+        self._bot(token).webhook_url = params.get('url', '')
+        return True
+    
+    async def _api_deleteWebhook(self, token, params):
+        self._bot(token).webhook_url = ''
+        return True
+    
+    async def _api_sendMessage(self, token, params):
+        chat_id = params['chat_id']
+        self._deliver(token, chat_id, params.get('text', ''))
+        return self._message(token, chat_id, params.get('text', ''))
+    
+    async def _api_copyMessage(self, token, params):
+        self._deliver(token, params['chat_id'], '[copy]')
+        return {'message_id': next(self._message_ids)}
+    
+    async def _api_editMessageText(self, token, params):
+        if 'inline_message_id' in params:
+            return True
+        chat_id = params['chat_id']
+        self._deliver(token, chat_id, params.get('text', ''))
+        return self._message(token, chat_id, params.get('text', ''), params.get('message_id'))
+    
+    async def _api_answerCallbackQuery(self, token, params):
+        return True
+    
+    def _message(self, token, chat_id, text, message_id=None):
+        return {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': self._bot(token).bot_id, 'is_bot': True, 'first_name': 'FakeBot'},
+            'text': text,
+        }
+
+
+def _parse_params(content_type, body):
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+        )
+        pairs = [
+            (part.get_param('name', header='content-disposition'), part.get_content())
+            for part in message.iter_parts()
+        ]
+    else:
+        pairs = parse_qsl(body.decode(), keep_blank_values=True)
+    
+    params = {}
+    for name, value in pairs:
+        if name in _RAW_PARAMS:
+            params[name] = value
+            continue
+        try:
+            params[name] = json.loads(value)
+        except (TypeError, ValueError):
+            params[name] = value
+    return params
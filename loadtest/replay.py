@@ -0,0 +1,222 @@
+"""Воспроизведение записанного потока апдейтов против FakeBotAPI
+
+Запись делает сам бот, если задан UPDATE_RECORD_PATH (см. recorder.py).
+
+Примеры:
+    python loadtest/replay.py updates.jsonl.gz --output before.json
+    python loadtest/replay.py updates.jsonl.gz --speed 10 --output after.json --compare before.json
+
+--speed 1 - исходный темп, 10 - в десять раз быстрее, 0 - без пауз.
+Сравнение выводит изменение задержки обработчиков (p95) между прогонами.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from loadtest.driver import TOKEN, FIRST_USER_ID, start_bot, stop_bot, metrics_summary  # noqa: E402
+from loadtest.fake_api import FakeBotAPI  # noqa: E402
+from config import ADMIN_IDS  # noqa: E402
+from recorder import read_records  # noqa: E402
+
+# Сообщений бота, хранимых на чат: replay читает только ответы с ключ-фразами
+INBOX_LIMIT = 100
+# Идентификатор для сессий, созданных до начала записи
+UNKNOWN_SESSION = '0' * 32
+
+
+def filler(length):
+    """Заполнитель вместо обезличенного текста"""
+    return 'x' * max(length, 1)
+
+
+class Replayer:
+    def __init__(self, api, bot, speed, timeout):
+        self.api = api
+        self.bot = bot
+        self.speed = speed
+        self.timeout = timeout
+        self.sessions = {}  # {номер сессии: Future[(ключ-фраза, session_id)]}
+        self.replayed = 0
+        self.missed_sessions = 0
+    
+    def user_id(self, number):
+        return FIRST_USER_ID + number
+    
+    def session(self, number):
+        future = self.sessions.get(number)
+        if future is None:
+            future = self.sessions[number] = asyncio.get_running_loop().create_future()
+        return future
+    
+    async def run(self, records):
+        start = time.perf_counter()
+        for record in records:
+            if self.speed:
+                delay = start + record['t'] / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self.feed(record)
+    
+    async def feed(self, record):
+        kind = record['k']
+        if kind == 'u':
+            if record.get('a'):
+                ADMIN_IDS.append(self.user_id(record['u']))
+            return
+        if kind == 's':
+            asyncio.create_task(self.capture_session(record['u'], record['s']))
+            return
+        
+        user_id = self.user_id(record.get('u', 0))
+        if kind == 'm':
+            text = filler(record['n'])
+            if 'c' in record:
+                text = f"{record['c']} {filler(record['n'])}" if record['n'] else record['c']
+            self.api.push_message(TOKEN, user_id, text)
+        elif kind == 'p':
+            resolved = await self.resolve(record.get('s', 0))
+            self.api.push_message(TOKEN, user_id, resolved[0] if resolved else filler(record.get('n', 0)))
+        elif kind == 'c':
+            data = record['d']
+            if 's' in record:
+                resolved = await self.resolve(record['s'])
+                data += resolved[1] if resolved else UNKNOWN_SESSION
+            self.api.push_callback(TOKEN, user_id, data)
+        else:
+            return
+        self.replayed += 1
+    
+    async def resolve(self, number):
+        """(ключ-фраза, session_id) сессии из записи или None, если ее нет"""
+        if not number:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.session(number)), self.timeout)
+        except asyncio.TimeoutError:
+            self.missed_sessions += 1
+            return None
+    
+    async def capture_session(self, user_number, session_number):
+        """Ключ-фраза и id сессии, созданной при воспроизведении (из ответа бота)"""
+        user_id = self.user_id(user_number)
+        try:
+            _, match = await self.api.wait_for(TOKEN, user_id, r'`([a-z0-9-]+)`', self.timeout)
+        except asyncio.TimeoutError:
+            self.missed_sessions += 1
+            return
+        route = self.bot.routing.current_route(user_id)
+        self.session(session_number).set_result((match.group(1), route[0] if route else UNKNOWN_SESSION))
+    
+    async def drain(self):
+        """Ожидание обработки всех отправленных апдейтов"""
+        deadline = time.perf_counter() + self.timeout
+        while time.perf_counter() < deadline:
+            busy = (
+                self.api.pending_updates(TOKEN)
+                or self.bot.application.update_queue.qsize()
+                or self.bot.outbound.in_flight
+                or self.bot.outbound.pending
+            )
+            if not busy:
+                return
+            await asyncio.sleep(0.05)
+
+
+async def replay(args):
+    api = await FakeBotAPI(inbox_limit=INBOX_LIMIT).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            bot = await start_bot(api, os.path.join(tmp, 'replay.db'))
+            try:
+                replayer = Replayer(api, bot, args.speed, args.timeout)
+                
+                print(f'Replaying {args.recording} at speed {args.speed or "max"}...', file=sys.stderr)
+                start = time.perf_counter()
+                await replayer.run(read_records(args.recording))
+                await replayer.drain()
+                elapsed = time.perf_counter() - start
+                
+                lag_p50, lag_p95, lag_p99 = bot.watchdog.lag_summary()
+            finally:
+                # Без остановки бота опрос обновлений не завершится и asyncio.run зависнет
+                await stop_bot(bot)
+    finally:
+        await api.stop()
+    
+    return {
+        'meta': {
+            'recording': str(args.recording),
+            'speed': args.speed,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'elapsed_s': elapsed,
+        'updates': replayer.replayed,
+        'missed_sessions': replayer.missed_sessions,
+        'loop_lag_ms': {'p50': lag_p50 * 1000, 'p95': lag_p95 * 1000, 'p99': lag_p99 * 1000},
+        'fake_api': {'requests': dict(api.request_counts)},
+        'handlers': metrics_summary('bot_handler'),
+        'database': metrics_summary('bot_db'),
+        'telegram': metrics_summary('bot_telegram'),
+    }
+
+
+def print_report(report):
+    print(f"\nReplayed {report['updates']} updates in {report['elapsed_s']:.1f}s"
+          f" ({report['missed_sessions']} sessions not resolved)")
+    lag = report['loop_lag_ms']
+    print(f"Loop lag: p50 {lag['p50']:.1f}ms, p95 {lag['p95']:.1f}ms, p99 {lag['p99']:.1f}ms")
+    
+    print(f'\n{"handler":32} {"count":>8} {"p50":>9} {"p95":>9} {"p99":>9}')
+    for label, row in report['handlers'].items():
+        print(f"{label:32} {row['count']:8} {row['p50_ms']:7.1f}ms {row['p95_ms']:7.1f}ms {row['p99_ms']:7.1f}ms")
+
+
+def compare(report, baseline_path):
+    """Печать изменения p95 относительно предыдущего прогона"""
+    baseline = json.loads(Path(baseline_path).read_text())
+    print(f'\n{"metric":40} {"baseline":>12} {"current":>12} {"change":>8}')
+    for section in ('handlers', 'database', 'telegram'):
+        for label, current in report[section].items():
+            previous = baseline.get(section, {}).get(label)
+            if not previous:
+                continue
+            before, after = previous['p95_ms'], current['p95_ms']
+            change = (after - before) / before * 100 if before else 0.0
+            print(f'{section + ":" + label:40} {before:10.3f}ms {after:10.3f}ms {change:+7.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded update stream against a fake Bot API')
+    parser.add_argument('recording', type=Path, help='file written by the bot with UPDATE_RECORD_PATH')
+    parser.add_argument('--speed', type=float, default=1.0, help='time acceleration, 0 - no pauses')
+    parser.add_argument('--timeout', type=float, default=30.0, help='wait for the bot, seconds')
+    parser.add_argument('--output', help='write JSON report to this file')
+    parser.add_argument('--compare', help='previous JSON report to compare against')
+    args = parser.parse_args()
+    
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logging.getLogger('bot').setLevel(logging.WARNING)
+    
+    report = asyncio.run(replay(args))
+    print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
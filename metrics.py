@@ -0,0 +1,237 @@
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек (в секундах)
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (как в Prometheus)"""
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+    
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # Последняя корзина - +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+    
+    def quantile(self, q):
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Счетчики, гистограммы и датчики с текстовым выводом в формате Prometheus"""
+    
+    def __init__(self):
+        self._histograms = {}  # {(name, labels): Histogram}
+        self._counters = {}  # {(name, labels): value}
+        self._gauges = {}  # {name: callable}
+        self._lock = threading.Lock()
+        # Какой обработчик сейчас выполняет каждая asyncio-задача (для watchdog)
+        self.active_handlers = {}  # {task: label}
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def gauge(self, name, func):
+        """Регистрация датчика: значение вычисляется при чтении"""
+        self._gauges[name] = func
+    
+    def timed(self, name, **labels):
+        """Декоратор: задержка в <name>_seconds, ошибки в <name>_errors_total
+
+        Работает как с обычными функциями, так и с корутинами.
+        """
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                label = ','.join(str(value) for value in labels.values()) or func.__name__
+                
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    task = asyncio.current_task()
+                    outer = self.active_handlers.get(task)
+                    self.active_handlers[task] = label
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception:
+                        self.inc(f'{name}_errors_total', **labels)
+                        raise
+                    finally:
+                        self.observe(f'{name}_seconds', time.perf_counter() - start, **labels)
+                        if outer is None:
+                            self.active_handlers.pop(task, None)
+                        else:
+                            self.active_handlers[task] = outer
+                return async_wrapper
+            
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    self.inc(f'{name}_errors_total', **labels)
+                    raise
+                finally:
+                    self.observe(f'{name}_seconds', time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+    
+    def instrument(self, name, label, coroutines_only=False):
+        """Декоратор класса: оборачивает все публичные методы в timed()"""
+        def decorator(cls):
+            for attr, func in list(vars(cls).items()):
+                if attr.startswith('_') or not inspect.isfunction(func):
+                    continue
+                if coroutines_only and not inspect.iscoroutinefunction(func):
+                    continue
+                setattr(cls, attr, self.timed(name, **{label: attr})(func))
+            return cls
+        return decorator
+    
+    def summary(self, name):
+        """Сводка по гистограмме: [(значение_метки, count, errors, p50, p95, p99), ...]
+
+        Отсортировано по суммарному времени (самые "дорогие" - первыми).
+        """
+        with self._lock:
+            items = [(labels, h) for (n, labels), h in self._histograms.items() if n == f'{name}_seconds']
+            rows = []
+            for labels, histogram in items:
+                errors = self._counters.get((f'{name}_errors_total', labels), 0)
+                rows.append((
+                    histogram.sum,
+                    ','.join(str(value) for _, value in labels),
+                    histogram.count,
+                    errors,
+                    histogram.quantile(0.5),
+                    histogram.quantile(0.95),
+                    histogram.quantile(0.99),
+                ))
+        rows.sort(reverse=True)
+        return [row[1:] for row in rows]
+    
+    def gauge_values(self):
+        """Текущие значения всех датчиков"""
+        values = {}
+        for name, func in self._gauges.items():
+            try:
+                values[name] = func()
+            except Exception as e:
+                logger.error(f"Failed to read gauge {name}: {e}")
+        return values
+    
+    def render(self):
+        """Текстовый формат Prometheus (exposition format 0.0.4)"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        
+        typed = set()
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        
+        for name, value in sorted(self.gauge_values().items()):
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+async def start_http_server(registry, host='127.0.0.1', port=9108):
+    """Минимальный HTTP-сервер: GET /metrics отдает registry.render()"""
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Пропускаем заголовки запроса
+            while (await reader.readline()).strip():
+                pass
+            
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/', '/metrics'):
+                status, body = '200 OK', registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            
+            writer.write(
+                f'HTTP/1.1 {status}\r\n'
+                'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                'Connection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    return await asyncio.start_server(handle, host, port)
+
+
+# Общий реестр метрик процесса
+metrics = MetricsRegistry()
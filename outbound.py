@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundDispatcher:
+    """Отправка сообщений в Telegram через ограниченный пул
+
+    Рассылка участникам сессии выполняется параллельно, но одновременно
+    в полете не больше max_concurrency запросов к Bot API.
+    """
+    
+    def __init__(self, max_concurrency=25, max_retries=3):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0  # Запросы, отправляемые прямо сейчас
+        self.pending = 0  # Запросы, ожидающие свободного слота
+    
+    async def send(self, bot, chat_id, text, **kwargs):
+        """Отправка одного сообщения с повтором при 429 (RetryAfter)"""
+        self.pending += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.pending -= 1
+        
+        self.in_flight += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return await bot.send_message(chat_id, text, **kwargs)
+                except RetryAfter as e:
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(e.retry_after)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+    
+    async def send_many(self, bot, chat_ids, text, **kwargs):
+        """Параллельная отправка одного текста нескольким пользователям
+
+        Возвращает (отправлено, не_отправлено).
+        """
+        chat_ids = list(chat_ids)
+        results = await asyncio.gather(
+            *(self.send(bot, chat_id, text, **kwargs) for chat_id in chat_ids),
+            return_exceptions=True
+        )
+        
+        failed = 0
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to send message to user {chat_id}: {result}")
+                failed += 1
+        return len(chat_ids) - failed, failed
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest с замером времени каждого вызова Bot API (по методам)"""
+    
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception:
+            metrics.inc('bot_telegram_errors_total', endpoint=endpoint)
+            raise
+        finally:
+            metrics.observe('bot_telegram_seconds', time.perf_counter() - start, endpoint=endpoint)
+        
+        if code >= 400:
+            metrics.inc('bot_telegram_errors_total', endpoint=endpoint)
+        return code, payload
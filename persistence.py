@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+
+from telegram.ext import ApplicationHandlerStop, BasePersistence, CallbackContext, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Состояние диалогов (user_data) и окно обработанных апдейтов в рабочей БД
+
+    user_data (флаги вроде awaiting_passphrase) переживает перезапуск бота.
+    Окно дедупликации - последние window значений update_id: апдейт, повторно
+    доставленный после аварийного завершения, пропускается.
+
+    Запись на диск пакетная: изменения копятся в памяти и сбрасываются одной
+    транзакцией не чаще раза в flush_interval секунд, без fsync на каждый
+    апдейт, поэтому апдейты последнего интервала после аварии могут прийти
+    снова. Для действий, которые нельзя повторять, отметка пишется сразу:
+    сообщение и новая сессия - в транзакции add_message и create_session
+    (update_id берется из UpdateContext), рассылка - через commit_update
+    до отправки.
+    """
+    
+    def __init__(self, db, window=10_000, flush_interval=1.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=flush_interval
+        )
+        self.db = db
+        self.window = window
+        self.flush_interval = flush_interval
+        self._seen = set()
+        self._order = deque()  # update_id в порядке обработки (для вытеснения из окна)
+        self._pending_updates = []
+        self._pending_users = {}  # {user_id: JSON или None - удалить}
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self._load_window()
+    
+    def _load_window(self):
+        conn = self.db.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT update_id FROM processed_updates ORDER BY update_id DESC LIMIT ?', (self.window,))
+        for (update_id,) in reversed(cursor.fetchall()):
+            self._remember(update_id)
+        conn.close()
+    
+    def _remember(self, update_id):
+        if update_id in self._seen:
+            return
+        self._seen.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.window:
+            self._seen.discard(self._order.popleft())
+    
+    # Дедупликация апдейтов
+    
+    async def skip_processed(self, update, context):
+        """Обработчик TypeHandler(Update) в первой группе: пропуск уже обработанного апдейта"""
+        if update.update_id in self._seen:
+            self.duplicates += 1
+            logger.warning(f"Skipping already processed update {update.update_id}")
+            raise ApplicationHandlerStop
+    
+    async def mark_processed(self, update, context):
+        """Обработчик TypeHandler(Update) в последней группе: апдейт обработан"""
+        with self._lock:
+            self._remember(update.update_id)
+            self._pending_updates.append(update.update_id)
+    
+    async def commit_update(self, update_id, user_id=None, user_data=None):
+        """Немедленная запись отметки апдейта (и user_data пользователя) - перед
+        действием, которое нельзя повторить. Если бот упадет посреди действия,
+        оно не будет выполнено заново (доставка не более одного раза).
+        """
+        with self._lock:
+            self._remember(update_id)
+            self._pending_updates.append(update_id)
+            if user_id is not None:
+                self._pending_users[user_id] = json.dumps(user_data) if user_data else None
+        await self.flush()
+    
+    async def run_flusher(self):
+        """Фоновая задача: периодический сброс накопленных изменений на диск"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self._write_pending)
+            except Exception as e:
+                logger.error(f"Failed to persist bot state: {e}")
+    
+    def _write_pending(self):
+        with self._lock:
+            updates, self._pending_updates = self._pending_updates, []
+            users, self._pending_users = self._pending_users, {}
+        if not updates and not users:
+            return
+        
+        conn = self.db.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(
+                'INSERT OR IGNORE INTO processed_updates (update_id) VALUES (?)',
+                [(update_id,) for update_id in updates]
+            )
+            # Окно на диске не больше, чем в памяти
+            cursor.execute('''
+                DELETE FROM processed_updates WHERE update_id < (
+                    SELECT update_id FROM processed_updates ORDER BY update_id DESC LIMIT 1 OFFSET ?
+                )
+            ''', (self.window - 1,))
+            cursor.executemany(
+                'INSERT OR REPLACE INTO user_state (user_id, data) VALUES (?, ?)',
+                [(user_id, data) for user_id, data in users.items() if data is not None]
+            )
+            cursor.executemany(
+                'DELETE FROM user_state WHERE user_id = ?',
+                [(user_id,) for user_id, data in users.items() if data is None]
+            )
+            conn.commit()
+        except Exception:
+            # Не потерять изменения: повторная попытка при следующем сбросе
+            with self._lock:
+                self._pending_updates[:0] = updates
+                for user_id, data in users.items():
+                    self._pending_users.setdefault(user_id, data)
+            raise
+        finally:
+            conn.close()
+    
+    # BasePersistence: хранится только user_data
+    
+    async def get_user_data(self):
+        conn = self.db.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id, data FROM user_state')
+        user_data = {user_id: json.loads(data) for user_id, data in cursor.fetchall()}
+        conn.close()
+        return user_data
+    
+    async def update_user_data(self, user_id, data):
+        # Пустое состояние не хранится: строки только у пользователей посреди диалога
+        with self._lock:
+            self._pending_users[user_id] = json.dumps(data) if data else None
+    
+    async def drop_user_data(self, user_id):
+        with self._lock:
+            self._pending_users[user_id] = None
+    
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+    
+    async def flush(self):
+        await asyncio.to_thread(self._write_pending)
+    
+    async def get_chat_data(self):
+        return {}
+    
+    async def get_bot_data(self):
+        return {}
+    
+    async def get_callback_data(self):
+        return None
+    
+    async def get_conversations(self, name):
+        return {}
+    
+    async def update_chat_data(self, chat_id, data):
+        pass
+    
+    async def update_bot_data(self, data):
+        pass
+    
+    async def update_callback_data(self, data):
+        pass
+    
+    async def update_conversation(self, name, key, new_state):
+        pass
+    
+    async def drop_chat_data(self, chat_id):
+        pass
+    
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+    
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+class UpdateContext(CallbackContext):
+    """CallbackContext с update_id обрабатываемого апдейта
+
+    Обработчики кнопок получают CallbackQuery, а не Update; update_id нужен им,
+    чтобы отметить апдейт обработанным в транзакции своего изменения в БД.
+    """
+    
+    @classmethod
+    def from_update(cls, update, application):
+        context = super().from_update(update, application)
+        context.update_id = getattr(update, 'update_id', None)
+        return context
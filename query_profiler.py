@@ -0,0 +1,188 @@
+import itertools
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# План запроса снимаем только для DML/SELECT
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+
+class _StatementStats:
+    """Накопленная статистика по одному SQL-выражению"""
+    __slots__ = ('count', 'total', 'max', 'slow_count', 'plan')
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow_count = 0
+        self.plan = None
+
+
+class QueryProfiler:
+    """Профилировщик SQL-запросов
+
+    Замеряет время каждого выражения (execute + fetch), пишет в лог
+    медленные запросы с замаскированными параметрами и один раз на каждое
+    выражение сохраняет его EXPLAIN QUERY PLAN.
+    """
+    
+    def __init__(self, slow_threshold_ms=50):
+        self.slow_threshold = slow_threshold_ms / 1000
+        self._stats = {}  # {нормализованный SQL: _StatementStats}
+        self._lock = threading.Lock()
+    
+    def record(self, conn, sql, params, elapsed, total, new_call):
+        """Учет фазы выполнения выражения
+
+        elapsed - время этой фазы, total - суммарное время выражения
+        с момента execute, new_call - True для самого execute.
+        """
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _StatementStats()
+            if new_call:
+                stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, total)
+            
+            # Выражение стало медленным именно на этой фазе
+            became_slow = total >= self.slow_threshold and (
+                new_call or total - elapsed < self.slow_threshold
+            )
+            if became_slow:
+                stats.slow_count += 1
+            need_plan = became_slow and stats.plan is None
+        
+        if not became_slow:
+            return
+        
+        logger.warning(
+            f"Slow query ({total * 1000:.1f} ms): {key} params={redact_params(params)}"
+        )
+        if need_plan:
+            plan = self.explain(conn, sql, params)
+            with self._lock:
+                stats.plan = plan
+            logger.warning(f"Query plan for slow query: {plan}")
+    
+    def explain(self, conn, sql, params):
+        """EXPLAIN QUERY PLAN для выражения (через непрофилируемый курсор)"""
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return '(not explainable)'
+        try:
+            cursor = conn.cursor(sqlite3.Cursor)
+            rows = cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+            cursor.close()
+        except sqlite3.Error as e:
+            return f'(explain failed: {e})'
+        return '; '.join(row[-1] for row in rows)
+    
+    def top(self, limit=10):
+        """Самые затратные выражения: [(sql, count, total, avg, max, slow_count, plan), ...]"""
+        with self._lock:
+            rows = [
+                (sql, s.count, s.total, s.total / s.count if s.count else 0.0, s.max, s.slow_count, s.plan)
+                for sql, s in self._stats.items()
+            ]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows[:limit]
+    
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Курсор, сообщающий профилировщику время execute и fetch*"""
+    
+    _sql = None
+    _params = ()
+    _elapsed = 0.0
+    
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._sql, self._params, self._elapsed = sql, parameters, elapsed
+            self.connection.profiler.record(self.connection, sql, parameters, elapsed, elapsed, True)
+    
+    def executemany(self, sql, seq_of_parameters):
+        # Первый набор параметров пакета нужен EXPLAIN QUERY PLAN для привязки;
+        # итератор не расходуем, а возвращаем первый элемент обратно в пакет
+        rows = iter(seq_of_parameters)
+        first = next(rows, None)
+        if first is not None:
+            rows = itertools.chain((first,), rows)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, rows)
+        finally:
+            elapsed = time.perf_counter() - start
+            params = () if first is None else first
+            self._sql, self._params, self._elapsed = None, (), 0.0
+            self.connection.profiler.record(self.connection, sql, params, elapsed, elapsed, True)
+    
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._sql is not None:
+                elapsed = time.perf_counter() - start
+                self._elapsed += elapsed
+                self.connection.profiler.record(
+                    self.connection, self._sql, self._params, elapsed, self._elapsed, False
+                )
+    
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+    
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._fetch(super().fetchmany)
+        return self._fetch(super().fetchmany, size)
+    
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Соединение, все курсоры которого профилируются"""
+    
+    profiler = None
+    
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def normalize_sql(sql):
+    """Выражение в одну строку (ключ для статистики)"""
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def redact_params(params):
+    """Параметры без значений: только типы (и длина для строк/байтов)"""
+    if isinstance(params, dict):
+        return {key: _redact(value) for key, value in params.items()}
+    return tuple(_redact(value) for value in params)
+
+
+def _redact(value):
+    if isinstance(value, (str, bytes)):
+        return f'<{type(value).__name__}:{len(value)}>'
+    return f'<{type(value).__name__}>'
@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import json
+import logging
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Версия формата записи
+RECORD_FORMAT = 1
+# Идентификатор сессии в callback_data (secrets.token_hex(16))
+_SESSION_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class UpdateRecorder:
+    """Запись входящих апдейтов для последующего воспроизведения
+
+    Файл - gzip со строками JSON. Данные обезличены: идентификаторы
+    пользователей заменены порядковыми номерами, вместо текста сохраняется
+    только его длина (при воспроизведении подставляется заполнитель), а
+    ключ-фразы и идентификаторы сессий - ссылками на сессии, созданные
+    во время записи.
+
+    Типы записей (поле k):
+        h - заголовок: начало записи
+        u - новый пользователь (a=1 для администратора)
+        m - текст: n - длина, c - команда (если текст начинается с /)
+        p - ключ-фраза: s - номер сессии или n - длина, если сессия неизвестна
+        c - нажатие кнопки: d - callback_data, s - номер сессии из данных
+        s - создана сессия с номером s
+    """
+    
+    def __init__(self, path, admin_ids=()):
+        path = Path(path)
+        if path.exists():
+            # Каждый запуск - отдельный файл: номера пользователей и сессий у записей независимы
+            stem, suffixes = path.name.split('.')[0], ''.join(path.suffixes)
+            path = path.with_name(f'{stem}-{datetime.now():%Y%m%d-%H%M%S}{suffixes}')
+        self.path = path
+        self.admin_ids = set(admin_ids)
+        self._file = gzip.open(path, 'xt', encoding='utf-8')
+        self._started = time.monotonic()
+        self._users = {}  # {user_id: номер}
+        self._sessions = {}  # {session_id: номер}
+        self._passphrases = {}  # {sha256(ключ-фразы): номер сессии}, только в памяти
+        self.records = 0
+        self._write({'k': 'h', 'v': RECORD_FORMAT, 'started': datetime.now().isoformat(timespec='seconds')})
+    
+    async def record(self, update, context):
+        """Обработчик TypeHandler(Update): запись апдейта перед обработкой"""
+        try:
+            if update.callback_query:
+                self._record_callback(update.callback_query)
+            elif update.message and update.message.text is not None and update.effective_user:
+                self._record_message(update.effective_user.id, update.message.text, context.user_data)
+        except Exception as e:
+            logger.error(f"Failed to record update {update.update_id}: {e}")
+    
+    def session_created(self, user_id, session_id, passphrase):
+        """Отметка о созданной сессии: по ней воспроизведение узнает ключ-фразу"""
+        number = len(self._sessions) + 1
+        self._sessions[session_id] = number
+        self._passphrases[_digest(passphrase)] = number
+        self._write({'k': 's', 'u': self._user(user_id), 's': number})
+    
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            logger.info(f"Recorded {self.records} updates to {self.path}")
+    
+    def _record_message(self, user_id, text, user_data):
+        record = {'k': 'm', 'u': self._user(user_id)}
+        if user_data and user_data.get('awaiting_passphrase'):
+            number = self._passphrases.get(_digest(text.strip().lower()))
+            record['k'] = 'p'
+            if number:
+                record['s'] = number
+            else:
+                record['n'] = len(text)
+        elif text.startswith('/'):
+            command, _, arguments = text.partition(' ')
+            record['c'] = command
+            record['n'] = len(arguments)
+        else:
+            record['n'] = len(text)
+        self._write(record)
+    
+    def _record_callback(self, query):
+        record = {'k': 'c', 'u': self._user(query.from_user.id), 'd': query.data or ''}
+        match = _SESSION_ID.search(record['d'])
+        if match:
+            # Номер сессии вместо идентификатора (0 - сессия создана до начала записи)
+            record['d'] = record['d'][:match.start()]
+            record['s'] = self._sessions.get(match.group(), 0)
+        self._write(record)
+    
+    def _user(self, user_id):
+        number = self._users.get(user_id)
+        if number is None:
+            number = self._users[user_id] = len(self._users) + 1
+            record = {'k': 'u', 'u': number}
+            if user_id in self.admin_ids:
+                record['a'] = 1
+            self._write(record)
+        return number
+    
+    def _write(self, record):
+        if self._file is None:
+            return
+        record['t'] = round(time.monotonic() - self._started, 3)
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.records += 1
+
+
+def _digest(passphrase):
+    return hashlib.sha256(passphrase.encode()).digest()
+
+
+def read_records(path):
+    """Чтение записи: генератор словарей в порядке записи"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                yield json.loads(line)
+        except (EOFError, ValueError):
+            # Оборванный конец файла после аварийного завершения бота
+            logger.warning(f"Recording {path} is truncated")
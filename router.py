@@ -0,0 +1,104 @@
+import re
+
+# Версия формата кнопок с параметрами: входит в префикс, поэтому кнопки
+# старого формата в истории чатов не попадут в обработчик с другими полями
+CALLBACK_VERSION = 1
+SEPARATOR = ':'
+# Ограничение Telegram на callback_data (в байтах)
+MAX_CALLBACK_DATA = 64
+
+_SESSION_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class Field:
+    """Параметр callback_data: преобразование значения в строку и обратно
+
+    decode должен бросать ValueError/KeyError на неверных данных.
+    """
+    __slots__ = ('decode', 'encode')
+    
+    def __init__(self, decode, encode=str):
+        self.decode = decode
+        self.encode = encode
+
+
+def _session_id(value):
+    if not _SESSION_ID.fullmatch(value):
+        raise ValueError(f"Invalid session id: {value!r}")
+    return value
+
+
+def choice(**codes):
+    """Поле из фиксированного набора значений: в callback_data - его короткий код"""
+    values = {value: code for code, value in codes.items()}
+    return Field(codes.__getitem__, values.__getitem__)
+
+
+INT = Field(int)
+SESSION_ID = Field(_session_id)
+
+
+class CallbackRoute:
+    """Кнопка с типизированными параметрами: '<версия><код>:<поле>:<поле>...'"""
+    __slots__ = ('prefix', 'fields')
+    
+    def __init__(self, code, *fields):
+        self.prefix = f'{CALLBACK_VERSION}{code}'
+        self.fields = fields
+    
+    def encode(self, *values):
+        data = SEPARATOR.join([self.prefix] + [field.encode(value) for field, value in zip(self.fields, values)])
+        if len(values) != len(self.fields) or len(data.encode('utf-8')) > MAX_CALLBACK_DATA:
+            raise ValueError(f"Invalid callback data: {data!r}")
+        return data
+    
+    def decode(self, payload):
+        parts = payload.split(SEPARATOR)
+        if len(parts) != len(self.fields):
+            raise ValueError(f"Expected {len(self.fields)} callback fields, got {len(parts)}")
+        return tuple(field.decode(part) for field, part in zip(self.fields, parts))
+
+
+class CallbackRouter:
+    """Диспетчеризация нажатий кнопок по таблице вместо цепочки if/elif
+
+    Кнопки без параметров ищутся по точному совпадению, кнопки с параметрами -
+    по префиксу до первого ':' (оба поиска - один словарь). Кнопки старого
+    формата (session_<id> и т.п.) остаются в сообщениях, отправленных до
+    обновления, и разбираются отдельными парсерами.
+    """
+    
+    def __init__(self):
+        self._static = {}  # {callback_data: обработчик}
+        self._routes = {}  # {префикс: (обработчик, CallbackRoute)}
+        self._legacy = []  # [(префикс, обработчик, разбор остатка -> аргументы)]
+    
+    def add(self, data, handler):
+        self._static[data] = handler
+    
+    def add_route(self, route, handler):
+        self._routes[route.prefix] = (handler, route)
+    
+    def add_legacy(self, prefix, handler, parse):
+        self._legacy.append((prefix, handler, parse))
+        # Более длинные префиксы проверяются первыми
+        self._legacy.sort(key=lambda item: len(item[0]), reverse=True)
+    
+    def resolve(self, data):
+        """(обработчик, аргументы) для callback_data или None, если кнопка неизвестна"""
+        handler = self._static.get(data)
+        if handler is not None:
+            return handler, ()
+        
+        prefix, separator, payload = data.partition(SEPARATOR)
+        entry = self._routes.get(prefix)
+        try:
+            if entry is not None and separator:
+                handler, route = entry
+                return handler, route.decode(payload)
+            for legacy_prefix, handler, parse in self._legacy:
+                if data.startswith(legacy_prefix):
+                    return handler, parse(data[len(legacy_prefix):])
+        except (ValueError, KeyError):
+            return None
+        return None
@@ -0,0 +1,162 @@
+import sys
+import threading
+import time
+from array import array
+
+
+class _SessionEntry:
+    """Участники сессии и время последней активности"""
+    __slots__ = ('members', 'last_activity')
+    
+    def __init__(self, now):
+        # Компактный массив int64 вместо списка Python-объектов
+        self.members = array('q')
+        self.last_activity = now
+
+
+class _UserRoute:
+    """Текущая сессия пользователя и его псевдоним в ней"""
+    __slots__ = ('session_id', 'pseudonym', 'last_seen')
+    
+    def __init__(self, session_id, pseudonym, now):
+        self.session_id = session_id
+        self.pseudonym = pseudonym
+        self.last_seen = now
+
+
+class SessionRegistry:
+    """Маршрутизация сообщений в памяти: пользователь -> сессия -> участники
+
+    Все операции выполняются за O(1) или O(число участников сессии).
+    Доступ защищен блокировкой, т.к. очистка работает в отдельном потоке.
+    """
+    
+    def __init__(self, idle_timeout=24 * 3600):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}  # {session_id: _SessionEntry}
+        self._users = {}  # {user_id: _UserRoute}
+        self._lock = threading.Lock()
+    
+    def join(self, user_id, session_id, pseudonym=None):
+        """Добавление пользователя в сессию (повторный вход ничего не дублирует)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._sessions[session_id] = _SessionEntry(now)
+            if user_id not in entry.members:
+                entry.members.append(user_id)
+            entry.last_activity = now
+            
+            route = self._users.get(user_id)
+            if route is None:
+                self._users[user_id] = _UserRoute(session_id, pseudonym, now)
+            else:
+                route.session_id = session_id
+                route.pseudonym = pseudonym
+                route.last_seen = now
+    
+    def add_members(self, memberships):
+        """Массовое добавление участников [(session_id, user_id), ...] одной блокировкой
+
+        Текущие сессии пользователей (маршруты) не меняются.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for session_id, user_id in memberships:
+                entry = self._sessions.get(session_id)
+                if entry is None:
+                    entry = self._sessions[session_id] = _SessionEntry(now)
+                if user_id not in entry.members:
+                    entry.members.append(user_id)
+    
+    def current_route(self, user_id):
+        """Текущая сессия пользователя и его псевдоним (отмечает активность)
+
+        Возвращает (session_id, pseudonym) или None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            route = self._users.get(user_id)
+            if route is None:
+                return None
+            entry = self._sessions.get(route.session_id)
+            if entry is None or user_id not in entry.members:
+                del self._users[user_id]
+                return None
+            route.last_seen = now
+            entry.last_activity = now
+            return route.session_id, route.pseudonym
+    
+    def members(self, session_id):
+        """Участники сессии"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return tuple(entry.members) if entry is not None else ()
+    
+    def member_count(self, session_id):
+        """Количество участников сессии"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return len(entry.members) if entry is not None else 0
+    
+    def all_members(self):
+        """Все пользователи, участвующие хотя бы в одной сессии"""
+        with self._lock:
+            users = set()
+            for entry in self._sessions.values():
+                users.update(entry.members)
+            return users
+    
+    def remove_session(self, session_id):
+        """Удаление сессии и маршрутов, которые на нее указывают"""
+        with self._lock:
+            self._drop_session(session_id)
+    
+    def retain_sessions(self, active_session_ids):
+        """Удаление всех сессий, кроме перечисленных. Возвращает количество удаленных"""
+        active_session_ids = set(active_session_ids)
+        with self._lock:
+            stale = [sid for sid in self._sessions if sid not in active_session_ids]
+            for session_id in stale:
+                self._drop_session(session_id)
+        return len(stale)
+    
+    def evict_idle(self, idle_timeout=None):
+        """Вытеснение сессий без активности дольше idle_timeout секунд"""
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        deadline = time.monotonic() - idle_timeout
+        with self._lock:
+            stale = [sid for sid, entry in self._sessions.items()
+                     if entry.last_activity < deadline]
+            for session_id in stale:
+                self._drop_session(session_id)
+        return len(stale)
+    
+    def _drop_session(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            return
+        for user_id in entry.members:
+            route = self._users.get(user_id)
+            if route is not None and route.session_id == session_id:
+                del self._users[user_id]
+    
+    @property
+    def user_count(self):
+        return len(self._users)
+    
+    @property
+    def session_count(self):
+        return len(self._sessions)
+    
+    def memory_usage(self):
+        """Приблизительный объем памяти, занимаемый структурами (в байтах)"""
+        with self._lock:
+            total = sys.getsizeof(self._sessions) + sys.getsizeof(self._users)
+            for session_id, entry in self._sessions.items():
+                total += sys.getsizeof(session_id) + sys.getsizeof(entry)
+                total += sys.getsizeof(entry.members)
+            for user_id, route in self._users.items():
+                total += sys.getsizeof(user_id) + sys.getsizeof(route)
+            return total
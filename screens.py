@@ -0,0 +1,158 @@
+"""Неизменяемые экраны бота: тексты и клавиатуры, собранные один раз при импорте
+
+InlineKeyboardMarkup в python-telegram-bot неизменяем, поэтому один объект
+безопасно отправлять в ответ на каждое нажатие. Кнопки с параметрами
+(сессии, страницы списка) собираются в bot.py через CallbackRoute.
+"""
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import ARCHIVE_DIR, ARCHIVE_RETENTION_DAYS, SESSION_TIMEOUT_HOURS
+
+
+def keyboard(*rows):
+    """Клавиатура из строк кнопок [(текст, callback_data), ...]"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(text, callback_data=data) for text, data in row]
+        for row in rows
+    ])
+
+
+_MAIN_MENU_ROWS = (
+    [("📝 Create Chat", "create_session")],
+    [("🔑 Join Chat", "join_session")],
+    [("📋 My Chats", "my_sessions")],
+    [("❓ Help", "help")],
+)
+
+MAIN_MENU_KEYBOARD = keyboard(*_MAIN_MENU_ROWS)
+# С кнопкой админ-панели
+ADMIN_MAIN_MENU_KEYBOARD = keyboard(*_MAIN_MENU_ROWS, [("👑 Admin Panel", "admin_panel")])
+
+BACK_TO_MENU_KEYBOARD = keyboard([("🔙 Back", "back_to_menu")])
+
+ADMIN_PANEL_KEYBOARD = keyboard(
+    [("📊 Statistics", "admin_stats")],
+    [("⚡ Performance", "admin_performance")],
+    [("💬 Active Sessions", "admin_active_sessions")],
+    [("📢 Broadcast Message", "admin_broadcast")],
+    [("🧹 Force Cleanup", "admin_cleanup")],
+    [("🔙 Back to Main Menu", "back_to_menu")],
+)
+
+BACK_TO_ADMIN_PANEL_KEYBOARD = keyboard([("🔙 Back to Admin Panel", "admin_panel")])
+
+ADMIN_STATS_KEYBOARD = keyboard(
+    [("🔄 Refresh", "admin_stats")],
+    [("🔙 Back to Admin Panel", "admin_panel")],
+)
+
+ADMIN_PERFORMANCE_KEYBOARD = keyboard(
+    [("🔄 Refresh", "admin_performance")],
+    [("🐢 Slow Queries", "admin_slow_queries")],
+    [("🔙 Back to Admin Panel", "admin_panel")],
+)
+
+ADMIN_SLOW_QUERIES_KEYBOARD = keyboard(
+    [("🔄 Refresh", "admin_slow_queries")],
+    [("🔙 Back to Performance", "admin_performance")],
+)
+
+ADMIN_SESSION_CLOSED_KEYBOARD = keyboard(
+    [("🔙 Back to Sessions", "admin_active_sessions")],
+    [("🔙 Back to Admin Panel", "admin_panel")],
+)
+
+BROADCAST_CANCEL_KEYBOARD = keyboard([("🔙 Cancel", "admin_panel")])
+
+CLEANUP_DONE_KEYBOARD = keyboard(
+    [("🔄 Refresh Stats", "admin_stats")],
+    [("🔙 Back to Admin Panel", "admin_panel")],
+)
+
+# Что происходит с закрытыми чатами (ARCHIVE_DIR пустой - архив отключен)
+if ARCHIVE_DIR:
+    _CLOSED_CHATS = f"Closed chats are kept in an encrypted archive for {ARCHIVE_RETENTION_DAYS} days, then deleted"
+else:
+    _CLOSED_CHATS = "Closed chats are kept encrypted in the database"
+
+WELCOME_TEXT = f"""
+🤫 Welcome to the anonymous messaging bot!
+
+🔒 Features:
+• Complete anonymity - we don't store message logs
+• Secure connection
+• Chats close after {SESSION_TIMEOUT_HOURS} hours of inactivity
+• {_CLOSED_CHATS}
+
+📖 How to use:
+1. Create a chat and get a passphrase
+2. Share the passphrase with your partners
+3. Start anonymous conversation
+
+Choose an action:
+""".strip()
+
+MAIN_MENU_TEXT = """
+🤫 Welcome to the anonymous messaging bot!
+
+Choose an action:
+""".strip()
+
+ASK_PASSPHRASE_TEXT = """
+🔑 Enter passphrase to join the chat:
+
+Format: word-word-word-word-word-word
+
+Example: `amber-dolphin-galaxy-encryption-phoenix-avocado`
+""".strip()
+
+
+def _help_text(admin_access):
+    return f"""
+❓ Bot Usage Help
+
+📖 Basic commands:
+• /start - Main menu
+• /help - This help
+
+🔐 How anonymity works:
+• Bot doesn't store message logs
+• Messages are encrypted in the database with a key derived from the chat passphrase
+• Chats close after {SESSION_TIMEOUT_HOURS} hours of inactivity
+• {_CLOSED_CHATS}
+• It's impossible to identify your partner
+
+🛡️ Security measures:
+• Use strong passphrases
+• Don't share passphrases with strangers
+• Sessions automatically close when inactive
+
+⚠️ Important:
+• {admin_access}
+• After a bot restart you may be asked to enter the passphrase again
+• For maximum security use one-time passphrases
+
+🔑 Passphrase format:
+• 6 random English words
+• Format: word-word-word-word-word-word
+• Example: quantum-dragon-avocado-symphony-volcano-cyber
+""".strip()
+
+
+HELP_TEXT = _help_text("Administrators don't have access to your message content")
+# Бот с поисковым индексом (SEARCH_INDEX_KEY): администраторы ищут сообщения по словам
+HELP_TEXT_SEARCH = _help_text(
+    "Administrators can't read your messages, but can find chats whose messages contain given words"
+)
+
+ADMIN_PANEL_TEXT = """
+👑 Admin Panel
+
+Choose an action:
+• 📊 Statistics - View bot usage statistics
+• ⚡ Performance - Handler, database and Telegram API latency
+• 💬 Active Sessions - View and manage active sessions
+• 📢 Broadcast - Send message to all users
+• 🧹 Cleanup - Force cleanup of old sessions and archiving of closed ones
+• 🔎 /search <words> - Find sessions by words in their messages
+""".strip()
@@ -0,0 +1,41 @@
+import hashlib
+import hmac
+import re
+
+# Слово сообщения: буквы/цифры любого алфавита
+_WORD = re.compile(r'\w+')
+# Длина токена в индексе (байт HMAC, в индексе - hex)
+TOKEN_SIZE = 8
+# Слова длиннее не индексируются (ссылки, base64 и т.п.)
+MAX_WORD_LENGTH = 64
+
+
+class SearchTokenizer:
+    """Слова сообщений -> токены для FTS5-индекса message_search
+
+    Тексты в БД зашифрованы ключами сессий, поэтому в индекс попадают не
+    слова, а их HMAC с секретом SEARCH_INDEX_KEY (в БД не хранится):
+    по индексу нельзя прочитать переписку, но можно найти сообщения с
+    заданными словами. Поиск - по точному совпадению слов без учета регистра.
+    """
+    __slots__ = ('_key',)
+    
+    def __init__(self, key):
+        self._key = key.encode('utf-8') if isinstance(key, str) else key
+    
+    def _token(self, word):
+        return hmac.new(self._key, word.encode('utf-8'), hashlib.sha256).hexdigest()[:TOKEN_SIZE * 2]
+    
+    def tokens(self, text):
+        """Уникальные токены слов текста в порядке появления"""
+        words = dict.fromkeys(word for word in _WORD.findall(text.casefold()) if len(word) <= MAX_WORD_LENGTH)
+        return [self._token(word) for word in words]
+    
+    def document(self, text):
+        """Значение колонки tokens для сообщения"""
+        return ' '.join(self.tokens(text))
+    
+    @staticmethod
+    def match(tokens):
+        """Выражение MATCH: все токены (И). Токены - hex, экранирование не нужно"""
+        return ' '.join(f'"{token}"' for token in tokens)
@@ -0,0 +1,111 @@
+import zlib
+
+from crypto import DecryptionError
+
+# Первый байт тела сообщения (BLOB) - его формат.
+# Несжатые незашифрованные сообщения хранятся как TEXT без заголовка
+FORMAT_TEXT = 0
+FORMAT_ZLIB = 1
+FORMAT_ZLIB_DICT = 2
+# Флаг шифрования: младшие биты - формат данных до шифрования,
+# за байтом формата - nonce, шифротекст и тег (см. crypto.SessionCipher)
+FLAG_ENCRYPTED = 0x80
+
+COMPRESSION_MODES = ('off', 'zlib', 'dict')
+
+# Короткие сообщения почти не сжимаются - храним как есть
+MIN_COMPRESS_LENGTH = 32
+
+# Предустановленный словарь для сжатия коротких сообщений (частые слова переписки).
+# Менять нельзя: им распакованы уже сохраненные сообщения. Для нового словаря -
+# новый FORMAT_*. Самые частые фрагменты - в конце (zlib дешевле ссылается на них)
+ZLIB_DICTIONARY = (
+    b"anonymous chat message passphrase session secret private someone anyone "
+    b"because through between without something everything nothing tomorrow "
+    b"yesterday morning evening tonight weekend really actually probably maybe "
+    b"please thanks thank you sorry okay sure great good nice cool awesome "
+    b"right now later soon today time people friend family work school home "
+    b"think know want need like love feel going make take come look tell say "
+    b"could would should will can't don't didn't won't isn't I'm you're it's "
+    b"that's what's there's let's where when why how who which what this that "
+    b"with from have been were they them their about just your know not but "
+    b"and the you for are was all one out get see can our his her she him "
+    b"? ! . , ... :) :( haha lol yes no hi hey hello bye "
+    b"I am you are it is do you have what do you think how are you "
+    b"in the of the to the on the and I I don't know I think "
+)
+
+
+class MessageCodec:
+    """Преобразование текста сообщения в значение для БД и обратно
+
+    mode: 'off' - только TEXT, 'zlib' - raw deflate, 'dict' - deflate с
+    предустановленным словарем (выгоднее для коротких сообщений). Сжатый
+    вариант сохраняется, только если он меньше исходного.
+
+    С cipher (crypto.SessionCipher) данные сначала сжимаются, затем шифруются.
+    """
+    
+    def __init__(self, mode='dict', min_length=MIN_COMPRESS_LENGTH):
+        if mode not in COMPRESSION_MODES:
+            raise ValueError(f"Unknown compression mode: {mode}")
+        self.mode = mode
+        self.min_length = min_length
+    
+    def encode(self, text, cipher=None):
+        """Текст -> str (без сжатия) или bytes (формат + сжатые/зашифрованные данные)"""
+        data = text.encode('utf-8')
+        value_format, payload = self._compress(data)
+        if cipher is not None:
+            header = bytes((FLAG_ENCRYPTED | value_format,))
+            return header + cipher.encrypt(payload, header)
+        if value_format == FORMAT_TEXT:
+            return text
+        return bytes((value_format,)) + payload
+    
+    def _compress(self, data):
+        """(формат, данные): сжатие, только если оно уменьшает размер"""
+        if self.mode == 'off' or len(data) < self.min_length:
+            return FORMAT_TEXT, data
+        
+        if self.mode == 'dict':
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=ZLIB_DICTIONARY)
+            value_format = FORMAT_ZLIB_DICT
+        else:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+            value_format = FORMAT_ZLIB
+        packed = compressor.compress(data) + compressor.flush()
+        # Байт формата тоже занимает место
+        if len(packed) + 1 < len(data):
+            return value_format, packed
+        return FORMAT_TEXT, data
+    
+    @staticmethod
+    def is_encrypted(value):
+        """Зашифровано ли значение из БД"""
+        return isinstance(value, bytes) and bool(value[0] & FLAG_ENCRYPTED)
+    
+    def decode(self, value, cipher=None):
+        """Значение из БД -> текст (формат определяется по самому значению)
+
+        Для зашифрованного значения нужен cipher его сессии, иначе DecryptionError.
+        """
+        if isinstance(value, str):
+            return value
+        
+        value_format, payload = value[0], value[1:]
+        if value_format & FLAG_ENCRYPTED:
+            if cipher is None:
+                raise DecryptionError("Session key is not available")
+            payload = cipher.decrypt(payload, value[:1])
+            value_format &= ~FLAG_ENCRYPTED
+        
+        if value_format == FORMAT_TEXT:
+            return payload.decode('utf-8')
+        if value_format == FORMAT_ZLIB_DICT:
+            decompressor = zlib.decompressobj(-15, zdict=ZLIB_DICTIONARY)
+        elif value_format == FORMAT_ZLIB:
+            decompressor = zlib.decompressobj(-15)
+        else:
+            raise ValueError(f"Unknown message storage format: {value_format}")
+        return (decompressor.decompress(payload) + decompressor.flush()).decode('utf-8')
@@ -0,0 +1,69 @@
+import os
+import re
+from pathlib import Path
+
+from config import ADMIN_IDS, ARCHIVE_DIR, BOT_TOKEN, SEARCH_INDEX_KEY, TENANTS, UPDATE_RECORD_PATH
+
+DEFAULT_DB_PATH = 'anonymous_messages.db'
+
+_TENANT_NAME = re.compile(r'[a-z0-9_]+')
+
+
+class Tenant:
+    """Один бот в процессе: токен, администраторы и собственные БД и архив
+
+    Сессии разных ботов не пересекаются: у каждого свой файл БД (и свое
+    окно update_id - они у каждого бота свои) и свой каталог архива.
+    """
+    __slots__ = ('name', 'token', 'admin_ids', 'db_path', 'archive_dir', 'record_path', 'search_key')
+    
+    def __init__(self, name, token, admin_ids, db_path, archive_dir='', record_path=None, search_key=''):
+        self.name = name
+        self.token = token
+        self.admin_ids = admin_ids
+        self.db_path = db_path
+        self.archive_dir = archive_dir
+        self.record_path = record_path
+        self.search_key = search_key
+
+
+def default_tenant():
+    """Единственный бот из BOT_TOKEN и ADMIN_IDS (режим без TENANTS)"""
+    # ADMIN_IDS - тот же список, что в config (loadtest/replay.py дополняет его)
+    return Tenant(
+        'default', BOT_TOKEN, ADMIN_IDS, DEFAULT_DB_PATH, ARCHIVE_DIR, UPDATE_RECORD_PATH, SEARCH_INDEX_KEY
+    )
+
+
+def _parse_ids(value):
+    return [int(id.strip()) for id in value.split(',') if id.strip()]
+
+
+def load_tenants(names=TENANTS, environ=os.environ):
+    """Боты процесса: для каждого имени из TENANTS - переменные <ИМЯ>_BOT_TOKEN,
+    <ИМЯ>_ADMIN_IDS и (для поиска в админке) <ИМЯ>_SEARCH_INDEX_KEY. Без TENANTS -
+    один бот из BOT_TOKEN и ADMIN_IDS.
+    """
+    if not names:
+        return [default_tenant()]
+    
+    tenants = []
+    for name in names:
+        if not _TENANT_NAME.fullmatch(name):
+            raise ValueError(f"Invalid tenant name: {name!r} (use a-z, 0-9 and _)")
+        prefix = name.upper()
+        token = environ.get(f'{prefix}_BOT_TOKEN')
+        if not token:
+            raise ValueError(f"{prefix}_BOT_TOKEN is not set for tenant {name!r}")
+        record_path = None
+        if UPDATE_RECORD_PATH:
+            path = Path(UPDATE_RECORD_PATH)
+            record_path = str(path.with_name(f'{name}-{path.name}'))
+        tenants.append(Tenant(
+            name, token, _parse_ids(environ.get(f'{prefix}_ADMIN_IDS', '')),
+            f'anonymous_messages-{name}.db',
+            os.path.join(ARCHIVE_DIR, name) if ARCHIVE_DIR else '',
+            record_path,
+            environ.get(f'{prefix}_SEARCH_INDEX_KEY', '')
+        ))
+    return tenants
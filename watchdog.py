@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    """Сторож цикла событий asyncio
+
+    Корутина-пульс раз в interval секунд засыпает и замеряет, насколько
+    позже она проснулась (задержка цикла, гистограмма bot_loop_lag_seconds).
+    Отдельный поток следит за пульсом: если цикл не отвечает дольше
+    threshold секунд, в лог пишется стек потока цикла и имя обработчика,
+    который сейчас выполняется, - т.е. блокирующий вызов виден прямо во время
+    зависания.
+    """
+    
+    def __init__(self, interval=0.1, threshold=0.5, registry=metrics):
+        self.interval = interval
+        self.threshold = threshold
+        self.registry = registry
+        self.stalls = 0
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = time.monotonic()
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+    
+    def start(self):
+        """Запуск пульса и потока-наблюдателя (вызывать внутри цикла событий)"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = self._loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._monitor, name='loop-watchdog', daemon=True)
+        self._thread.start()
+    
+    async def stop(self):
+        """Остановка пульса и потока-наблюдателя"""
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - scheduled - self.interval)
+            self.registry.observe('bot_loop_lag_seconds', lag)
+            self._last_beat = time.monotonic()
+    
+    def _monitor(self):
+        reported_beat = None
+        while not self._stopped.wait(self.interval):
+            last_beat = self._last_beat
+            stalled_for = time.monotonic() - last_beat
+            # Об одном зависании сообщаем один раз
+            if stalled_for < self.threshold or reported_beat == last_beat:
+                continue
+            reported_beat = last_beat
+            self.stalls += 1
+            self.registry.inc('bot_loop_stalls_total')
+            self._report(stalled_for)
+    
+    def _report(self, stalled_for):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame, limit=15)) if frame else '(no frame)'
+        
+        handler = None
+        try:
+            task = asyncio.current_task(self._loop)
+            handler = self.registry.active_handlers.get(task)
+        except RuntimeError:
+            pass
+        
+        logger.warning(
+            f"Event loop blocked for {stalled_for * 1000:.0f} ms "
+            f"(handler: {handler or 'unknown'}). Loop thread stack:\n{stack}"
+        )
+    
+    def lag_summary(self):
+        """Перцентили задержки цикла: (p50, p95, p99) в секундах"""
+        rows = self.registry.summary('bot_loop_lag')
+        if not rows:
+            return 0.0, 0.0, 0.0
+        _, _, _, p50, p95, p99 = rows[0]
+        return p50, p95, p99